@@ -9,6 +9,12 @@ from app.config import Settings
 
 logger = logging.getLogger("tinychat")
 
+# Message validation constants, built once at import
+_VALID_ROLES = frozenset(['user', 'assistant', 'system'])
+_VALID_IMAGE_TYPES = ('image/jpeg', 'image/png', 'image/gif', 'image/webp')
+_BASE64_RE = re.compile(r'^[A-Za-z0-9+/]*={0,2}$')
+_MAX_IMAGE_BYTES = 10 * 1024 * 1024  # 10MB
+
 
 class RLMPasscodeRequest(BaseModel):
     """
@@ -52,9 +58,9 @@ class ChatRequest(BaseModel):
     @classmethod
     def validate_model(cls, v):
         """Ensure requested model is available."""
-        if v is not None and v not in Settings.AVAILABLE_MODELS:
-            logger.error(f"Invalid model requested: '{v}'. Available models: {', '.join(Settings.AVAILABLE_MODELS)}")
-            raise ValueError(f"Model must be one of: {', '.join(Settings.AVAILABLE_MODELS)}")
+        if v is not None and v not in Settings.AVAILABLE_MODELS_SET:
+            logger.error(f"Invalid model requested: '{v}'. Available models: {Settings.AVAILABLE_MODELS_STR}")
+            raise ValueError(f"Model must be one of: {Settings.AVAILABLE_MODELS_STR}")
         return v
     
     @field_validator('messages')
@@ -66,37 +72,39 @@ class ChatRequest(BaseModel):
         Checks that each message has required fields, valid role,
         and content within length limits. Also validates optional image fields.
         """
+        max_length = Settings.MAX_MESSAGE_LENGTH
         for msg in v:
-            if 'role' not in msg or 'content' not in msg:
+            role = msg.get('role')
+            content = msg.get('content')
+            if role is None or content is None:
                 raise ValueError("Each message must have 'role' and 'content'")
-            if msg['role'] not in ['user', 'assistant', 'system']:
+            if role not in _VALID_ROLES:
                 raise ValueError("Role must be 'user', 'assistant', or 'system'")
-            if len(msg['content']) > Settings.MAX_MESSAGE_LENGTH:
-                raise ValueError(f"Message content too long (max {Settings.MAX_MESSAGE_LENGTH})")
+            if len(content) > max_length:
+                raise ValueError(f"Message content too long (max {max_length})")
             
             # Validate optional image fields
-            if 'image' in msg:
+            image_data = msg.get('image')
+            if image_data is not None:
                 # Validate image is base64 string (basic check)
-                image_data = msg['image']
                 if not isinstance(image_data, str) or len(image_data) == 0:
                     raise ValueError("Image data must be a non-empty string")
                 
                 # Check for valid base64 characters (basic validation)
-                if not re.match(r'^[A-Za-z0-9+/]*={0,2}$', image_data):
+                if not _BASE64_RE.match(image_data):
                     raise ValueError("Image data must be valid base64")
                 
                 # Validate image_type if image is present
-                if 'image_type' not in msg:
+                image_type = msg.get('image_type')
+                if image_type is None:
                     raise ValueError("image_type is required when image is provided")
                 
-                valid_types = ['image/jpeg', 'image/png', 'image/gif', 'image/webp']
-                if msg['image_type'] not in valid_types:
-                    raise ValueError(f"image_type must be one of: {', '.join(valid_types)}")
+                if image_type not in _VALID_IMAGE_TYPES:
+                    raise ValueError(f"image_type must be one of: {', '.join(_VALID_IMAGE_TYPES)}")
                 
                 # Estimate size (base64 is ~1.33x original size)
                 estimated_size = (len(image_data) * 3) / 4
-                max_size = 10 * 1024 * 1024  # 10MB
-                if estimated_size > max_size:
+                if estimated_size > _MAX_IMAGE_BYTES:
                     raise ValueError(f"Image too large (max 10MB)")
         
         return v
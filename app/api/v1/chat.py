@@ -1,6 +1,5 @@
 """Chat streaming endpoint."""
 
-import json
 import logging
 
 from fastapi import APIRouter, HTTPException, Request
@@ -13,12 +12,31 @@ from app.services.rlm_service import RLMService
 from app.services.image_service import ImageService
 from app.services.logging_service import LoggingService
 from app.utils.security import get_client_ip
-from app.utils.state import StateManager
+from app.utils.sse import coalesce_frames, sse_content, sse_event
+from app.utils.state import counters, generation_slot, rlm_slot, track_session
 
 logger = logging.getLogger("tinychat")
 
 router = APIRouter()
 
+# Response headers shared by every SSE stream. Any new streaming route must
+# use these: no-transform and X-Accel-Buffering stop reverse proxies (nginx
+# and similar) from buffering or compressing the stream, which would hold
+# back tokens until the response completes.
+_SSE_HEADERS = {
+    "Cache-Control": "no-cache, no-transform",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"
+}
+
+# Constant SSE frames, encoded once at import
+_SSE_GENERATING_IMAGE = sse_content('Generating image...')
+_SSE_IMAGE_FAILED = sse_content('Failed to generate image.')
+_SSE_RLM_MISSING = sse_event({'error': 'RLM module not installed. Please rebuild the container with RLM support.'})
+_SSE_RLM_AUTH_REQUIRED = sse_event({'error': 'RLM access requires authentication. Please enable RLM through the web interface.'})
+_SSE_RLM_INVALID_PASSCODE = sse_event({'error': 'Invalid RLM passcode. Access denied.'})
+_SSE_RLM_CAPACITY = sse_event({'error': 'Too many concurrent RLM requests. Please try again later.'})
+
 
 @router.post("/api/chat/stream")
 async def chat_stream(request: ChatRequest, http_request: Request):
@@ -45,9 +63,9 @@ async def chat_stream(request: ChatRequest, http_request: Request):
     model_to_use = request.model or Settings.DEFAULT_MODEL
     temp_to_use = request.temperature or Settings.DEFAULT_TEMPERATURE
     
-    logger.debug(f"Chat stream request from {client_ip}: {len(request.messages)} messages")
-    logger.debug(f"  Model: {model_to_use} (requested: {request.model or 'default'})")
-    logger.debug(f"  Temperature: {temp_to_use}")
+    logger.debug("Chat stream request from %s: %d messages", client_ip, len(request.messages))
+    logger.debug("  Model: %s (requested: %s)", model_to_use, request.model or 'default')
+    logger.debug("  Temperature: %s", temp_to_use)
     
     # Validate API key
     if not Settings.OPENAI_API_KEY:
@@ -56,177 +74,143 @@ async def chat_stream(request: ChatRequest, http_request: Request):
     
     # Track session if provided
     if request.session_id:
-        await StateManager.track_session(request.session_id)
+        track_session(request.session_id)
     
-    # Check if this is an image generation request
-    last_message = request.messages[-1]["content"] if request.messages else ""
-    last_message_lower = last_message.strip().lower()
-    is_image_request = last_message_lower.startswith("@image") or last_message_lower.startswith("/image")
+    # Check if this is an image generation request; only the head of the
+    # message is inspected so long messages aren't copied just to test a prefix
+    last_message = request.messages[-1]["content"]
+    command = last_message[:64].lstrip()[:6].lower()
+    is_image_request = command == "@image" or command == "/image"
     
     if is_image_request:
         # Remove the command prefix (@image or /image)
-        if last_message_lower.startswith("@image"):
-            image_prompt = last_message.strip()[6:].strip()
-        else:  # /image
-            image_prompt = last_message.strip()[6:].strip()
+        image_prompt = last_message.strip()[6:].strip()
         
         async def image_gen():
-            await StateManager.increment_generations()
-            
-            try:
-                logger.info(f"Image generation request from {client_ip}: {image_prompt}")
-                
-                # Send initial message
-                yield f"data: {json.dumps({'content': 'Generating image...'})}\n\n"
-                
-                # Generate the image
-                result = await ImageService.generate_image(image_prompt)
-                
-                if "error" in result:
-                    error_msg = f"Error generating image: {result['error']}"
-                    yield f"data: {json.dumps({'content': error_msg})}\n\n"
-                else:
-                    # Send the image data
-                    response_data = {
-                        'image': result['image_data'], 
-                        'content': 'Here is your image.'
-                    }
-                    yield f"data: {json.dumps(response_data)}\n\n"
+            async with generation_slot():
+                try:
+                    logger.info(f"Image generation request from {client_ip}: {image_prompt}")
                     
-                    # Log conversation
-                    LoggingService.log_conversation(
-                        request.messages, 
-                        f"[Generated image: {image_prompt}]", 
-                        "image-gen", 
-                        0.0
-                    )
-            except Exception as e:
-                logger.error(f"Error in image generation: {e}")
-                yield f"data: {json.dumps({'content': 'Failed to generate image.'})}\n\n"
-            finally:
-                await StateManager.decrement_generations()
+                    # Send initial message
+                    yield _SSE_GENERATING_IMAGE
+                    
+                    # Generate the image
+                    result = await ImageService.generate_image(image_prompt)
+                    
+                    if "error" in result:
+                        error_msg = f"Error generating image: {result['error']}"
+                        yield sse_content(error_msg)
+                    else:
+                        # Send the image data
+                        response_data = {
+                            'image': result['image_data'], 
+                            'content': 'Here is your image.'
+                        }
+                        yield sse_event(response_data)
+                        
+                        # Log conversation
+                        LoggingService.log_conversation(
+                            request.messages, 
+                            f"[Generated image: {image_prompt}]", 
+                            "image-gen", 
+                            0.0
+                        )
+                except Exception as e:
+                    logger.error(f"Error in image generation: {e}")
+                    yield _SSE_IMAGE_FAILED
         
         return StreamingResponse(
             image_gen(), 
-            media_type="text/plain", 
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-                "Content-Type": "text/event-stream"
-            }
+            media_type="text/event-stream", 
+            headers=_SSE_HEADERS
         )
     
     # Handle RLM requests
     if request.rlm:
         if not Settings.HAS_RLM:
             async def rlm_missing_gen():
-                yield f"data: {json.dumps({'error': 'RLM module not installed. Please rebuild the container with RLM support.'})}\n\n"
-            return StreamingResponse(rlm_missing_gen(), media_type="text/event-stream")
+                yield _SSE_RLM_MISSING
+            return StreamingResponse(rlm_missing_gen(), media_type="text/event-stream", headers=_SSE_HEADERS)
         
         # SECURITY: Validate RLM passcode on backend
         if Settings.RLM_PASSCODE:
             if not request.rlm_passcode:
                 logger.warning(f"🚫 RLM request without passcode from {client_ip}")
                 async def rlm_auth_error_gen():
-                    yield f"data: {json.dumps({'error': 'RLM access requires authentication. Please enable RLM through the web interface.'})}\n\n"
-                return StreamingResponse(rlm_auth_error_gen(), media_type="text/event-stream")
+                    yield _SSE_RLM_AUTH_REQUIRED
+                return StreamingResponse(rlm_auth_error_gen(), media_type="text/event-stream", headers=_SSE_HEADERS)
             
             if request.rlm_passcode != Settings.RLM_PASSCODE:
                 logger.warning(f"🚫 RLM request with INVALID passcode from {client_ip}")
                 async def rlm_invalid_passcode_gen():
-                    yield f"data: {json.dumps({'error': 'Invalid RLM passcode. Access denied.'})}\n\n"
-                return StreamingResponse(rlm_invalid_passcode_gen(), media_type="text/event-stream")
+                    yield _SSE_RLM_INVALID_PASSCODE
+                return StreamingResponse(rlm_invalid_passcode_gen(), media_type="text/event-stream", headers=_SSE_HEADERS)
             
             logger.info(f"✓ RLM passcode validated for {client_ip}")
         
         async def rlm_generate():
-            await StateManager.increment_generations()
-            
-            # Check RLM concurrency limit
-            if not await StateManager.check_rlm_capacity():
-                yield f"data: {json.dumps({'error': 'Too many concurrent RLM requests. Please try again later.'})}\n\n"
-                await StateManager.decrement_generations()
-                return
-            
-            await StateManager.increment_rlm_generations()
-            
-            try:
-                rlm_count = await StateManager.get_active_rlm_generations()
-                logger.info(f"RLM generation request from {client_ip} for model: {model_to_use} (active RLM: {rlm_count})")
-                
-                # Stream RLM completion
-                assistant_full_content = ""
-                async for chunk in RLMService.stream_rlm_completion(
-                    request.messages, 
-                    model_to_use,
-                    request.show_rlm_thinking
-                ):
-                    yield chunk
-                    # Extract content for logging
-                    if 'content' in chunk:
-                        try:
-                            data = json.loads(chunk.split("data: ", 1)[1])
-                            if 'content' in data:
-                                assistant_full_content += data['content']
-                        except:
-                            pass
-                
-                # Log conversation
-                LoggingService.log_conversation(
-                    request.messages, 
-                    assistant_full_content, 
-                    f"{model_to_use}-rlm", 
-                    temp_to_use
-                )
-            finally:
-                await StateManager.decrement_generations()
-                await StateManager.decrement_rlm_generations()
+            async with generation_slot():
+                async with rlm_slot() as admitted:
+                    # Enforce RLM concurrency limit; reject rather than queue
+                    if not admitted:
+                        yield _SSE_RLM_CAPACITY
+                        return
+                    
+                    rlm_count = counters.rlm_generations
+                    logger.info(f"RLM generation request from {client_ip} for model: {model_to_use} (active RLM: {rlm_count})")
+                    
+                    # Stream RLM completion, collecting content deltas for logging
+                    assistant_parts = []
+                    async for chunk, delta in RLMService.stream_rlm_completion(
+                        request.messages, 
+                        model_to_use,
+                        request.show_rlm_thinking
+                    ):
+                        yield chunk
+                        if delta:
+                            assistant_parts.append(delta)
+                    
+                    # Log conversation
+                    LoggingService.log_conversation(
+                        request.messages, 
+                        "".join(assistant_parts), 
+                        f"{model_to_use}-rlm", 
+                        temp_to_use
+                    )
         
         return StreamingResponse(
             rlm_generate(), 
             media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive"
-            }
+            headers=_SSE_HEADERS
         )
     
     # Standard LLM streaming
     async def stream_response():
-        await StateManager.increment_generations()
-        
-        try:
-            assistant_full_content = ""
-            async for chunk in LLMService.stream_completion(
-                request.messages, 
-                temp_to_use, 
-                model_to_use
+        async with generation_slot():
+            # Collect content deltas for logging
+            assistant_parts = []
+            async for chunk, delta in coalesce_frames(
+                LLMService.stream_completion(
+                    request.messages, 
+                    temp_to_use, 
+                    model_to_use
+                ),
+                Settings.SSE_COALESCE_MS / 1000
             ):
                 yield chunk
-                # Extract content for logging
-                if 'content' in chunk:
-                    try:
-                        data = json.loads(chunk.split("data: ", 1)[1])
-                        if 'content' in data:
-                            assistant_full_content += data['content']
-                    except:
-                        pass
+                if delta:
+                    assistant_parts.append(delta)
             
             # Log conversation
             LoggingService.log_conversation(
                 request.messages, 
-                assistant_full_content, 
+                "".join(assistant_parts), 
                 model_to_use, 
                 temp_to_use
             )
-        finally:
-            await StateManager.decrement_generations()
     
     return StreamingResponse(
         stream_response(), 
         media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive"
-        }
+        headers=_SSE_HEADERS
     )
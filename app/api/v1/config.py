@@ -1,6 +1,5 @@
 """Configuration and system endpoints."""
 
-import uuid
 import logging
 from datetime import datetime
 from typing import Optional
@@ -9,8 +8,9 @@ from fastapi import APIRouter, Request
 
 from app.api.schemas import RLMPasscodeRequest
 from app.config import Settings
+from app.services.logging_service import LoggingService
 from app.utils.security import get_client_ip
-from app.utils.state import StateManager
+from app.utils.state import counters, get_active_sessions, track_session
 
 logger = logging.getLogger("tinychat")
 
@@ -114,10 +114,11 @@ async def create_session(session_id: Optional[str] = None):
         dict: Session ID for tracking
     """
     if not session_id:
+        import uuid
         session_id = str(uuid.uuid4())
     
-    await StateManager.track_session(session_id)
-    active_count = await StateManager.get_active_sessions()
+    track_session(session_id)
+    active_count = get_active_sessions()
     
     return {
         "session_id": session_id,
@@ -130,7 +131,8 @@ async def health_check():
     """
     Health check endpoint for monitoring and load balancers.
     
-    Returns basic service health status, active sessions, and concurrent generations.
+    Returns basic service health status, active sessions, concurrent generations,
+    and how many conversation log entries have been dropped.
     
     Returns:
         dict: Health status with:
@@ -138,13 +140,15 @@ async def health_check():
             - timestamp: Current timestamp
             - active_sessions: Number of sessions (page loads) in last 5 minutes
             - active_generations: Number of concurrent streaming generations
+            - dropped_log_entries: Conversation log entries dropped because the log queue was full
     """
-    active_sessions = await StateManager.get_active_sessions()
-    active_gens = await StateManager.get_active_generations()
+    active_sessions = get_active_sessions()
+    active_gens = counters.generations
     
     return {
         "status": "healthy",
         "timestamp": datetime.now(),
         "active_sessions": active_sessions,
-        "active_generations": active_gens
+        "active_generations": active_gens,
+        "dropped_log_entries": LoggingService.get_dropped_entries()
     }
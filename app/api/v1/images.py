@@ -0,0 +1,29 @@
+"""Vision image endpoint used when images are sent to the LLM by URL."""
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import Response
+
+from app.utils.image_store import get_image
+
+router = APIRouter()
+
+
+@router.get("/api/vision/{token}")
+async def get_vision_image(token: str):
+    """
+    Serve an uploaded image to the upstream LLM API.
+    
+    Only used when VISION_IMAGE_BASE_URL is set. Tokens are random and
+    expire after a few minutes, so the URL acts as a short-lived capability.
+    
+    Args:
+        token: Token issued when the image was stored
+        
+    Returns:
+        Response: The raw image bytes
+    """
+    image = get_image(token)
+    if image is None:
+        raise HTTPException(status_code=404, detail="Image not found")
+    data, media_type = image
+    return Response(content=data, media_type=media_type, headers={"Cache-Control": "no-store"})
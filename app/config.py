@@ -3,9 +3,10 @@ Configuration management for TinyChat.
 
 Centralizes all environment variable loading and validation.
 """
+import importlib.util
 import os
 import logging
-from typing import List
+from typing import FrozenSet, List
 
 logger = logging.getLogger("tinychat")
 
@@ -22,6 +23,9 @@ class Settings:
     DEFAULT_MODEL: str = os.getenv("DEFAULT_MODEL", "gpt-3.5-turbo")
     DEFAULT_TEMPERATURE: float = float(os.getenv("DEFAULT_TEMPERATURE", "0.7"))
     
+    # Streaming Configuration
+    SSE_COALESCE_MS: int = int(os.getenv("SSE_COALESCE_MS", "10"))
+    
     # Security Configuration
     MAX_MESSAGE_LENGTH: int = int(os.getenv("MAX_MESSAGE_LENGTH", "262144"))
     MAX_CONVERSATION_HISTORY: int = int(os.getenv("MAX_CONVERSATION_HISTORY", "50"))
@@ -31,6 +35,7 @@ class Settings:
     
     # Research/Logging Configuration
     CHAT_LOG: str = os.getenv("CHAT_LOG", "")
+    CHAT_LOG_QUEUE_SIZE: int = int(os.getenv("CHAT_LOG_QUEUE_SIZE", "1024"))
     
     # Image Generation Configuration
     IMAGE_PROVIDER: str = os.getenv("IMAGE_PROVIDER", "swarmui").lower()
@@ -59,12 +64,18 @@ class Settings:
     # Image Upload & Vision Configuration
     MAX_IMAGE_SIZE_MB: int = int(os.getenv("MAX_IMAGE_SIZE_MB", "10"))
     SUPPORTED_IMAGE_TYPES: List[str] = ["image/jpeg", "image/png", "image/gif", "image/webp"]
+    VISION_MAX_DIM: int = int(os.getenv("VISION_MAX_DIM", "1024"))
+    VISION_JPEG_QUALITY: int = int(os.getenv("VISION_JPEG_QUALITY", "85"))
+    VISION_DETAIL: str = os.getenv("VISION_DETAIL", "").lower()
+    VISION_IMAGE_BASE_URL: str = os.getenv("VISION_IMAGE_BASE_URL", "").rstrip("/")
     
     # Session Configuration
     SESSION_TIMEOUT_MINUTES: int = 5
     
     # Available models
     AVAILABLE_MODELS: List[str] = []
+    AVAILABLE_MODELS_SET: FrozenSet[str] = frozenset()
+    AVAILABLE_MODELS_STR: str = ""
     
     @classmethod
     def initialize(cls):
@@ -81,12 +92,12 @@ class Settings:
             logger.warning(f"   Adding '{cls.DEFAULT_MODEL}' to available models list")
             cls.AVAILABLE_MODELS.insert(0, cls.DEFAULT_MODEL)
         
-        # Check for RLM
-        try:
-            import rlm
-            cls.HAS_RLM = True
-        except ImportError:
-            cls.HAS_RLM = False
+        # Precompute lookup set and display string for request validation
+        cls.AVAILABLE_MODELS_SET = frozenset(cls.AVAILABLE_MODELS)
+        cls.AVAILABLE_MODELS_STR = ", ".join(cls.AVAILABLE_MODELS)
+        
+        # Check for RLM without importing it; it is loaded on first use
+        cls.HAS_RLM = importlib.util.find_spec("rlm") is not None
         
         cls._log_configuration()
     
@@ -115,6 +126,9 @@ class Settings:
         if cls.CHAT_LOG:
             logger.info(f"  Research: Logging conversations to {cls.CHAT_LOG}")
         
+        if cls.VISION_IMAGE_BASE_URL:
+            logger.info(f"  Vision: Sending images by URL via {cls.VISION_IMAGE_BASE_URL}")
+        
         logger.info(f"  Image Generation: Provider={cls.IMAGE_PROVIDER}")
         if cls.IMAGE_PROVIDER == "swarmui":
             logger.info(f"  Image Generation: SwarmUI={cls.SWARMUI}, Model={cls.IMAGE_MODEL}")
@@ -14,19 +14,27 @@ License: MIT
 GitHub: https://github.com/jasonacox/tinychat
 """
 
+import asyncio
 import logging
 import os
+from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.exceptions import RequestValidationError
 
 from app.config import Settings
-from app.middleware.security import setup_security_middleware, add_security_headers
+from app.middleware.compression import setup_compression_middleware
+from app.middleware.security import setup_security_middleware
+from app.services.image_service import ImageService
+from app.services.llm_service import LLMService
+from app.services.logging_service import LoggingService
 from app.utils.error_handlers import validation_exception_handler
+from app.utils.state import start_session_reaper, stop_session_reaper
 from app.api.v1.root import router as root_router
 from app.api.v1.chat import router as chat_router
 from app.api.v1.config import router as config_router
+from app.api.v1.images import router as images_router
 
 # Configure logging
 logging.basicConfig(
@@ -35,21 +43,35 @@ logging.basicConfig(
 )
 logger = logging.getLogger("tinychat")
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Check the event loop and start background tasks; stop them and release shared clients on shutdown."""
+    loop_name = type(asyncio.get_running_loop()).__module__
+    if not loop_name.startswith("uvloop"):
+        logger.warning("Not running on uvloop (%s); start uvicorn with --loop uvloop", loop_name)
+    start_session_reaper()
+    yield
+    stop_session_reaper()
+    await LLMService.close_client()
+    await ImageService.close_session()
+    await LoggingService.shutdown()
+
+
 # Create FastAPI app
 app = FastAPI(
     title="TinyChat",
     description="A minimal chatbot interface",
     docs_url=None if not Settings.ENABLE_DEBUG_LOGS else "/docs",
-    redoc_url=None if not Settings.ENABLE_DEBUG_LOGS else "/redoc"
+    redoc_url=None if not Settings.ENABLE_DEBUG_LOGS else "/redoc",
+    lifespan=lifespan
 )
 
-# Setup security middleware
-setup_security_middleware(app)
+# Compress non-streaming responses (SSE is passed through)
+setup_compression_middleware(app)
 
-# Add security headers middleware
-@app.middleware("http")
-async def security_headers_middleware(request, call_next):
-    return await add_security_headers(request, call_next)
+# Setup security middleware (trusted hosts, CORS and security headers)
+setup_security_middleware(app)
 
 # Add error handlers
 app.add_exception_handler(RequestValidationError, validation_exception_handler)
@@ -58,17 +80,22 @@ app.add_exception_handler(RequestValidationError, validation_exception_handler)
 app.include_router(root_router)
 app.include_router(chat_router)
 app.include_router(config_router)
+app.include_router(images_router)
 
 # Mount static files
 static_dir = "static" if os.path.exists("static") else "app/static"
 app.mount("/static", StaticFiles(directory=static_dir), name="static")
 
 if __name__ == "__main__":
+    # Production runs (see Dockerfile) select the same uvloop event loop and
+    # httptools parser: uvicorn app.main:app --loop uvloop --http httptools
     import uvicorn
     uvicorn.run(
         "main:app",
         host="0.0.0.0",
         port=8000,
         reload=True,
-        log_level="info"
+        log_level="info",
+        loop="uvloop",
+        http="httptools"
     )
@@ -0,0 +1,31 @@
+"""Response compression middleware."""
+
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+# Routes that stream SSE; gzip buffering would hold back tokens
+_STREAMING_PATHS = frozenset({"/api/chat/stream"})
+
+
+class CompressionMiddleware:
+    """
+    Gzip non-streaming responses, passing SSE routes through untouched.
+    
+    Streaming paths are skipped by path rather than relying on the installed
+    Starlette version's content-type exclusions.
+    """
+    
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        self.app = app
+        self.gzip = GZipMiddleware(app, minimum_size=minimum_size)
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] == "http" and scope["path"] not in _STREAMING_PATHS:
+            await self.gzip(scope, receive, send)
+        else:
+            await self.app(scope, receive, send)
+
+
+def setup_compression_middleware(app):
+    """Add gzip compression for responses of at least 1 KB."""
+    app.add_middleware(CompressionMiddleware, minimum_size=1024)
@@ -1,32 +1,50 @@
 """Security middleware for HTTP headers and CORS."""
 
-from fastapi import Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.middleware.trustedhost import TrustedHostMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from app.config import Settings
 
+# Security headers applied to every response, built once at import
+_SECURITY_HEADERS = (
+    ("X-Content-Type-Options", "nosniff"),
+    ("X-Frame-Options", "DENY"),
+    ("X-XSS-Protection", "1; mode=block"),
+    ("Strict-Transport-Security", "max-age=31536000; includeSubDomains"),
+    ("Content-Security-Policy", (
+        "default-src 'self'; "
+        "script-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net https://cdnjs.cloudflare.com; "
+        "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net https://cdnjs.cloudflare.com; "
+        "font-src 'self' https://cdn.jsdelivr.net; "
+        "img-src 'self' data:"
+    )),
+)
 
-def setup_security_middleware(app):
-    """Add security middleware to the FastAPI app."""
-    
-    # Add trusted host middleware if hosts are configured
-    if Settings.ALLOWED_HOSTS != ["*"]:
-        app.add_middleware(TrustedHostMiddleware, allowed_hosts=Settings.ALLOWED_HOSTS)
-    
-    # Add CORS middleware
-    app.add_middleware(
-        CORSMiddleware,
-        allow_origins=Settings.ALLOWED_ORIGINS,
-        allow_credentials=True,
-        allow_methods=["GET", "POST", "DELETE"],
-        allow_headers=["*"],
-    )
+# Same headers lower-cased and encoded once for the raw ASGI header list
+_RAW_SECURITY_HEADERS = tuple(
+    (name.lower().encode("latin-1"), value.encode("latin-1"))
+    for name, value in _SECURITY_HEADERS
+)
+
+# Canned headers for the permissive (allow-all origins) CORS path
+_CORS_ALLOW_ALL_HEADERS = (
+    (b"access-control-allow-origin", b"*"),
+    (b"vary", b"origin"),
+)
+_CORS_PREFLIGHT_HEADERS = (
+    (b"access-control-allow-origin", b"*"),
+    (b"access-control-allow-methods", b"GET, POST, DELETE"),
+    (b"access-control-allow-headers", b"*"),
+    (b"access-control-max-age", b"600"),
+    (b"vary", b"origin"),
+    (b"content-length", b"0"),
+)
 
 
-async def add_security_headers(request: Request, call_next):
+class SecurityHeadersMiddleware:
     """
-    Middleware to add security headers to all HTTP responses.
+    Pure ASGI middleware that adds security headers to all HTTP responses.
     
     Adds headers for:
     - X-Content-Type-Options: Prevent MIME sniffing
@@ -35,23 +53,81 @@ async def add_security_headers(request: Request, call_next):
     - Strict-Transport-Security: Enforce HTTPS
     - Content-Security-Policy: Restrict resource loading
     
-    Args:
-        request: The incoming request
-        call_next: The next middleware/handler in the chain
+    Headers are appended to the http.response.start message, so response
+    bodies (including SSE streams) pass through untouched.
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-    Returns:
-        Response with added security headers
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *_RAW_SECURITY_HEADERS]
+            await send(message)
+        
+        await self.app(scope, receive, send_with_headers)
+
+
+class AllowAllCORSMiddleware:
     """
-    response = await call_next(request)
-    response.headers["X-Content-Type-Options"] = "nosniff"
-    response.headers["X-Frame-Options"] = "DENY"
-    response.headers["X-XSS-Protection"] = "1; mode=block"
-    response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-    response.headers["Content-Security-Policy"] = (
-        "default-src 'self'; "
-        "script-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net https://cdnjs.cloudflare.com; "
-        "style-src 'self' 'unsafe-inline' https://cdn.jsdelivr.net https://cdnjs.cloudflare.com; "
-        "font-src 'self' https://cdn.jsdelivr.net; "
-        "img-src 'self' data:"
-    )
-    return response
+    Pure ASGI CORS middleware for ALLOWED_ORIGINS == ["*"].
+    
+    With every origin allowed and no credentials there is nothing to match,
+    so preflight requests get a canned 204 and all other responses get a
+    fixed Access-Control-Allow-Origin header.
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        if scope["method"] == "OPTIONS" and any(
+            name == b"access-control-request-method" for name, _ in scope["headers"]
+        ):
+            await send({
+                "type": "http.response.start",
+                "status": 204,
+                "headers": list(_CORS_PREFLIGHT_HEADERS),
+            })
+            await send({"type": "http.response.body", "body": b""})
+            return
+        
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", ()), *_CORS_ALLOW_ALL_HEADERS]
+            await send(message)
+        
+        await self.app(scope, receive, send_with_headers)
+
+
+def setup_security_middleware(app):
+    """Add security middleware to the FastAPI app."""
+    
+    # Add trusted host middleware if hosts are configured
+    if Settings.ALLOWED_HOSTS != ["*"]:
+        app.add_middleware(TrustedHostMiddleware, allowed_hosts=Settings.ALLOWED_HOSTS)
+    
+    # Add CORS middleware; TinyChat sets no cookies, so the allow-all case
+    # needs no credential handling and can use the canned-header middleware
+    if Settings.ALLOWED_ORIGINS == ["*"]:
+        app.add_middleware(AllowAllCORSMiddleware)
+    else:
+        app.add_middleware(
+            CORSMiddleware,
+            allow_origins=Settings.ALLOWED_ORIGINS,
+            allow_credentials=True,
+            allow_methods=["GET", "POST", "DELETE"],
+            allow_headers=["*"],
+        )
+    
+    # Added last so it wraps everything, including CORS responses
+    app.add_middleware(SecurityHeadersMiddleware)
@@ -1,21 +1,55 @@
 """Image generation service for SwarmUI and OpenAI."""
 
+import asyncio
 import base64
 import io
 import logging
-from typing import Optional
+import time
+from typing import Optional, Tuple
 
 import aiohttp
+import orjson
 from PIL import Image
 
 from app.config import Settings
 
 logger = logging.getLogger("tinychat")
 
+# Longest side of images returned to the browser
+_MAX_DIM = 1024
+
+# Shared aiohttp session (created lazily on first use, closed on shutdown)
+_session: Optional[aiohttp.ClientSession] = None
+
+# Cached SwarmUI session id as (session_id, monotonic time obtained)
+_swarmui_session: Optional[Tuple[str, float]] = None
+_SWARMUI_SESSION_TTL = 600.0
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
 
 class ImageService:
     """Service for generating images via SwarmUI or OpenAI."""
     
+    @staticmethod
+    def get_session() -> aiohttp.ClientSession:
+        """Get the shared aiohttp session, creating it on first use."""
+        global _session
+        if _session is None or _session.closed:
+            _session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=50, ttl_dns_cache=300, keepalive_timeout=60)
+            )
+        return _session
+    
+    @staticmethod
+    async def close_session():
+        """Close the shared aiohttp session (called on application shutdown)."""
+        global _session, _swarmui_session
+        if _session is not None:
+            await _session.close()
+            _session = None
+        _swarmui_session = None
+    
     @staticmethod
     async def generate_image(prompt: str) -> dict:
         """
@@ -30,47 +64,69 @@ class ImageService:
         logger.info(f"Image provider: {Settings.IMAGE_PROVIDER}")
         
         if Settings.IMAGE_PROVIDER == "swarmui":
-            image_encoded = await ImageService._generate_swarmui(prompt)
+            image_bytes = await ImageService._generate_swarmui(prompt)
         elif Settings.IMAGE_PROVIDER == "openai":
-            image_encoded = await ImageService._generate_openai(prompt)
+            image_bytes = await ImageService._generate_openai(prompt)
         else:
             logger.error(f"Unknown IMAGE_PROVIDER: {Settings.IMAGE_PROVIDER}")
             return {"error": "Unsupported image provider"}
         
-        if not image_encoded:
+        if not image_bytes:
             logger.error(f"Image generation failed for prompt: {prompt}")
             return {"error": "Generation failed"}
         
-        # Normalize to raw base64 payload
-        if "," in image_encoded:
-            image_b64 = image_encoded.split(",", 1)[1]
-        else:
-            image_b64 = image_encoded
-        
-        logger.info(f"Received image data (bytes ~ {len(image_b64)})")
+        logger.info(f"Received image data (bytes ~ {len(image_bytes)})")
         
+        # Decode, resize and re-encode off the event loop
         try:
-            image = Image.open(io.BytesIO(base64.b64decode(image_b64)))
+            jpeg_bytes = await asyncio.to_thread(ImageService._to_web_jpeg, image_bytes)
         except Exception:
             return {"error": "Unable to decode image data"}
         
-        # Resize down for web if necessary
-        max_dim = 1024
-        if image.width > max_dim or image.height > max_dim:
-            image.thumbnail((max_dim, max_dim))
+        out_b64 = base64.b64encode(jpeg_bytes).decode("utf-8")
+        data_uri = f"data:image/jpeg;base64,{out_b64}"
+        
+        return {"prompt": prompt, "image_data": data_uri}
+    
+    @staticmethod
+    def _to_web_jpeg(image_bytes: bytes) -> bytes:
+        """
+        Downscale an image for the web and encode it as JPEG.
+        
+        CPU-bound; called via asyncio.to_thread so concurrent image
+        requests do not block the event loop.
+        
+        Args:
+            image_bytes: Raw image data from the provider
+            
+        Returns:
+            bytes: JPEG-encoded image no larger than _MAX_DIM on either side
+        """
+        image = Image.open(io.BytesIO(image_bytes))
+        # For JPEG sources let libjpeg DCT-downscale during decode; no-op otherwise
+        image.draft("RGB", (_MAX_DIM, _MAX_DIM))
+        
+        # Resize down for web if necessary; BILINEAR is much cheaper than the
+        # default LANCZOS and indistinguishable at thumbnail ratios
+        if image.width > _MAX_DIM or image.height > _MAX_DIM:
+            image.thumbnail((_MAX_DIM, _MAX_DIM), Image.Resampling.BILINEAR, reducing_gap=2.0)
         # Convert to JPEG for browser-friendliness
         if image.mode == "RGBA":
             image = image.convert("RGB")
         out = io.BytesIO()
-        image.save(out, format="JPEG", quality=90)
-        out_b64 = base64.b64encode(out.getvalue()).decode("utf-8")
-        data_uri = f"data:image/jpeg;base64,{out_b64}"
-        
-        return {"prompt": prompt, "image_data": data_uri}
+        image.save(
+            out,
+            format="JPEG",
+            quality=85,
+            optimize=False,
+            progressive=False,
+            subsampling=2,
+        )
+        return out.getvalue()
     
     @staticmethod
-    async def _generate_swarmui(prompt: str) -> Optional[str]:
-        """Generate image using SwarmUI."""
+    async def _generate_swarmui(prompt: str) -> Optional[bytes]:
+        """Generate image using SwarmUI and return the raw image bytes."""
         logger.info(f"Sending prompt to SwarmUI ({Settings.SWARMUI}) model={Settings.IMAGE_MODEL}")
         logger.info(f"Prompt: {prompt}")
         
@@ -78,11 +134,12 @@ class ImageService:
             try:
                 async with session.post(
                     f"{Settings.SWARMUI.rstrip('/')}/API/GetNewSession", 
-                    json={}, 
+                    data=b"{}", 
+                    headers=_JSON_HEADERS,
                     timeout=10
                 ) as resp:
                     if resp.status == 200:
-                        data = await resp.json()
+                        data = await resp.json(loads=orjson.loads)
                         return data.get("session_id")
             except Exception as e:
                 logger.error(f"Error getting session id from SwarmUI: {e}")
@@ -117,11 +174,12 @@ class ImageService:
             try:
                 async with session.post(
                     f"{Settings.SWARMUI.rstrip('/')}/API/GenerateText2Image", 
-                    json=data, 
+                    data=orjson.dumps(data), 
+                    headers=_JSON_HEADERS,
                     timeout=Settings.IMAGE_TIMEOUT
                 ) as resp:
                     if resp.status == 200:
-                        j = await resp.json()
+                        j = await resp.json(loads=orjson.loads)
                         imgs = j.get("images") or []
                         if imgs:
                             return imgs[0]
@@ -131,27 +189,43 @@ class ImageService:
                 logger.error(f"Error calling SwarmUI GenerateText2Image: {e}")
             return None
         
+        global _swarmui_session
         image_encoded = None
         try:
-            async with aiohttp.ClientSession() as session:
+            session = ImageService.get_session()
+            if _swarmui_session and time.monotonic() - _swarmui_session[1] < _SWARMUI_SESSION_TTL:
+                session_id = _swarmui_session[0]
+            else:
                 session_id = await _get_session_id(session)
                 if not session_id:
                     logger.error("Unable to obtain SwarmUI session id")
                     return None
-                image_encoded = await _call_generate(session, session_id, prompt)
+                _swarmui_session = (session_id, time.monotonic())
+            image_encoded = await _call_generate(session, session_id, prompt)
+            if not image_encoded:
+                # Session id may have expired on the SwarmUI side; fetch a new one next time
+                _swarmui_session = None
         except Exception as e:
             logger.error(f"Unexpected error during SwarmUI generation: {e}")
             return None
         
-        return image_encoded
+        if not image_encoded:
+            return None
+        
+        # SwarmUI returns a data URI; strip the prefix and decode once
+        try:
+            return base64.b64decode(image_encoded.partition(",")[2] or image_encoded)
+        except Exception:
+            logger.error("Unable to decode SwarmUI image data")
+            return None
     
     @staticmethod
-    async def _generate_openai(prompt: str) -> Optional[str]:
-        """Generate image using OpenAI."""
+    async def _generate_openai(prompt: str) -> Optional[bytes]:
+        """Generate image using OpenAI and return the raw image bytes."""
         logger.info(f"Sending prompt to OpenAI Images API ({Settings.OPENAI_IMAGE_API_BASE}) model={Settings.OPENAI_IMAGE_MODEL}")
         logger.info(f"Prompt: {prompt}")
         
-        async def _call_openai(session: aiohttp.ClientSession, prompt_text: str) -> Optional[str]:
+        async def _call_openai(session: aiohttp.ClientSession, prompt_text: str) -> Optional[bytes]:
             url = f"{Settings.OPENAI_IMAGE_API_BASE.rstrip('/')}/images/generations"
             headers = {
                 "Authorization": f"Bearer {Settings.OPENAI_IMAGE_API_KEY}", 
@@ -165,24 +239,23 @@ class ImageService:
             try:
                 async with session.post(
                     url, 
-                    json=body, 
+                    data=orjson.dumps(body), 
                     headers=headers, 
                     timeout=Settings.IMAGE_TIMEOUT
                 ) as resp:
                     if resp.status == 200:
-                        j = await resp.json()
+                        j = await resp.json(loads=orjson.loads)
                         data = j.get("data") or []
                         if data:
                             first = data[0]
                             if "b64_json" in first:
-                                return first["b64_json"]
+                                return base64.b64decode(first["b64_json"])
                             if "url" in first:
-                                # Fetch binary and return as base64
+                                # Fetch binary and return it as-is
                                 img_url = first["url"]
                                 async with session.get(img_url) as img_resp:
                                     if img_resp.status == 200:
-                                        b = await img_resp.read()
-                                        return base64.b64encode(b).decode("utf-8")
+                                        return await img_resp.read()
                     else:
                         text = await resp.text()
                         logger.error(f"OpenAI images API returned {resp.status}: {text}")
@@ -190,12 +263,11 @@ class ImageService:
                 logger.error(f"Error calling OpenAI Images API: {e}")
             return None
         
-        image_encoded = None
+        image_bytes = None
         try:
-            async with aiohttp.ClientSession() as session:
-                image_encoded = await _call_openai(session, prompt)
+            image_bytes = await _call_openai(ImageService.get_session(), prompt)
         except Exception as e:
             logger.error(f"Unexpected error during OpenAI generation: {e}")
             return None
         
-        return image_encoded
+        return image_bytes
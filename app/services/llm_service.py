@@ -1,20 +1,95 @@
 """LLM service for handling OpenAI-compatible API interactions."""
 
-import json
+import asyncio
+import base64
+import hashlib
+import io
 import logging
-import traceback
-from typing import Dict, List, AsyncGenerator
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, AsyncGenerator, Optional, Tuple
 
 import httpx
+import orjson
+from PIL import Image
 
 from app.config import Settings
+from app.utils.image_store import store_image
+from app.utils.sse import iter_sse_data, sse_content, sse_content_raw, sse_event
 
 logger = logging.getLogger("tinychat")
 
+# Shared client so connections (and HTTP/2 streams) are reused across requests
+_client: Optional[httpx.AsyncClient] = None
+
+# Request headers derive only from static settings, so build them once,
+# along with the redacted copy shown in DEBUG dumps
+_REQUEST_HEADERS = {
+    "Authorization": f"Bearer {Settings.OPENAI_API_KEY}",
+    "Content-Type": "application/json"
+}
+_REDACTED_HEADERS_JSON = orjson.dumps(
+    {**_REQUEST_HEADERS, "Authorization": f"Bearer ***{Settings.OPENAI_API_KEY[-4:]}"},
+    option=orjson.OPT_INDENT_2
+).decode()
+
+# Recently downscaled images keyed by a digest of their base64 data and type.
+# The client resends the same image with every turn, so follow-up turns reuse
+# the result instead of decoding and resizing it again. Filled from worker
+# threads, hence the lock.
+_DOWNSCALE_CACHE_SIZE = 16
+_downscale_cache: "OrderedDict[bytes, Tuple[str, str]]" = OrderedDict()
+_downscale_cache_lock = threading.Lock()
+
+# Separators for the DEBUG request/response dumps
+_BANNER = "=" * 80
+_BANNER_SHORT = "=" * 60
+
+# Error text fragments indicating the model rejected image input
+_VISION_ERR_RE = re.compile(
+    r"image|vision|multimodal|content type|invalid content|content array"
+    r"|should be a valid string|input should be",
+    re.IGNORECASE
+)
+
+# Fast path for the common delta chunk shape: captures the body of the first
+# "content" string (escapes kept, control characters rejected as JSON does)
+_CONTENT_RE = re.compile(rb'"content"\s*:\s*"([^"\\\x00-\x1f]*(?:\\.[^"\\\x00-\x1f]*)*)"')
+
 
 class LLMService:
     """Service for interacting with LLM APIs."""
     
+    @staticmethod
+    def get_client() -> httpx.AsyncClient:
+        """Get the shared HTTP client, creating it on first use."""
+        global _client
+        if _client is None or _client.is_closed:
+            _client = httpx.AsyncClient(
+                http2=True,
+                headers={"Accept-Encoding": "gzip, br"},
+                timeout=httpx.Timeout(30.0, connect=5.0),
+                limits=httpx.Limits(max_keepalive_connections=64, max_connections=256)
+            )
+        return _client
+    
+    @staticmethod
+    async def close_client():
+        """Close the shared HTTP client (called on application shutdown)."""
+        global _client
+        if _client is not None:
+            await _client.aclose()
+            _client = None
+    
+    @staticmethod
+    def _last_image_index(messages: List[Dict]) -> Optional[int]:
+        """Return the index of the last message carrying an image, or None."""
+        for i in range(len(messages) - 1, -1, -1):
+            if messages[i].get('image'):
+                return i
+        return None
+    
     @staticmethod
     def filter_images_keep_latest(messages: List[Dict]) -> List[Dict]:
         """
@@ -23,36 +98,108 @@ class LLMService:
         This prevents API errors with LLMs that only support single images.
         Keeps the last user message with an image, removes all prior images.
         
+        The kept image is downscaled, and when VISION_IMAGE_BASE_URL is set
+        it is also decoded to raw bytes here, so callers that run this off
+        the event loop do all of the image work in one step.
+        
         Args:
             messages: Full conversation history
             
         Returns:
             Filtered messages with only the most recent image
         """
-        # Find index of last message with image
-        last_image_idx = None
-        for i in range(len(messages) - 1, -1, -1):
-            if messages[i].get('image'):
-                last_image_idx = i
-                break
+        last_image_idx = LLMService._last_image_index(messages)
         
         # If no images found, return as-is
         if last_image_idx is None:
             return messages
         
-        # Remove all images except the last one
+        # Remove all images except the last one, which is downscaled; only
+        # messages that carry an image are copied
         filtered = []
         for i, msg in enumerate(messages):
-            msg_copy = msg.copy()
-            if msg_copy.get('image') and i != last_image_idx:
+            if i == last_image_idx:
+                msg = msg.copy()
+                msg['image'], msg['image_type'] = LLMService._downscale_image(
+                    msg['image'], msg.get('image_type', 'image/jpeg')
+                )
+                if Settings.VISION_IMAGE_BASE_URL:
+                    # Served by URL, so hand over bytes rather than base64
+                    msg['image'] = base64.b64decode(msg['image'])
+            elif msg.get('image'):
                 # Remove image from this message
-                msg_copy.pop('image', None)
-                msg_copy.pop('image_type', None)
-            filtered.append(msg_copy)
+                msg = {k: v for k, v in msg.items() if k not in ('image', 'image_type')}
+            filtered.append(msg)
         
-        logger.debug(f"Filtered images: kept image at index {last_image_idx}, removed {sum(1 for m in messages if m.get('image')) - 1} older images")
+        if logger.isEnabledFor(logging.DEBUG):
+            removed = sum(1 for m in messages if m.get('image')) - 1
+            logger.debug("Filtered images: kept image at index %d, removed %d older images", last_image_idx, removed)
         return filtered
     
+    @staticmethod
+    def _downscale_image(image_b64: str, image_type: str) -> Tuple[str, str]:
+        """
+        Downscale a base64 image so its longest side is at most VISION_MAX_DIM.
+        
+        Images already within the limit (or when VISION_MAX_DIM is 0) are
+        returned unchanged. Larger images are re-encoded as JPEG, or PNG when
+        they have transparency. Undecodable data is passed through so the
+        upstream API reports the error as before. Results are cached, so an
+        image resent on a later turn is only processed once.
+        
+        Args:
+            image_b64: Base64-encoded image data (no data: prefix)
+            image_type: MIME type of the image
+            
+        Returns:
+            tuple: (image_b64, image_type) to send to the model
+        """
+        if Settings.VISION_MAX_DIM <= 0:
+            return image_b64, image_type
+        
+        key = hashlib.blake2b(image_b64.encode("utf-8", "surrogatepass"), digest_size=16).digest() + image_type.encode()
+        with _downscale_cache_lock:
+            cached = _downscale_cache.get(key)
+            if cached is not None:
+                _downscale_cache.move_to_end(key)
+                return cached
+        
+        result = LLMService._resize_image(image_b64, image_type)
+        with _downscale_cache_lock:
+            _downscale_cache[key] = result
+            while len(_downscale_cache) > _DOWNSCALE_CACHE_SIZE:
+                _downscale_cache.popitem(last=False)
+        return result
+    
+    @staticmethod
+    def _resize_image(image_b64: str, image_type: str) -> Tuple[str, str]:
+        """Decode, resize and re-encode an image for _downscale_image (uncached)."""
+        max_dim = Settings.VISION_MAX_DIM
+        try:
+            image = Image.open(io.BytesIO(base64.b64decode(image_b64)))
+            if image.width <= max_dim and image.height <= max_dim:
+                return image_b64, image_type
+            
+            # For JPEG sources let libjpeg DCT-downscale during decode
+            image.draft("RGB", (max_dim, max_dim))
+            image.thumbnail((max_dim, max_dim), Image.Resampling.LANCZOS, reducing_gap=2.0)
+            
+            out = io.BytesIO()
+            if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+                image.save(out, format="PNG")
+                out_type = "image/png"
+            else:
+                if image.mode != "RGB":
+                    image = image.convert("RGB")
+                image.save(out, format="JPEG", quality=Settings.VISION_JPEG_QUALITY)
+                out_type = "image/jpeg"
+        except Exception as e:
+            logger.warning(f"Unable to downscale image, sending original: {e}")
+            return image_b64, image_type
+        
+        logger.debug("Downscaled image to %dx%d (%s)", image.width, image.height, out_type)
+        return base64.b64encode(out.getvalue()).decode("ascii"), out_type
+    
     @staticmethod
     def format_message_for_vision_api(message: Dict) -> Dict:
         """
@@ -72,7 +219,8 @@ class LLMService:
         - Any OpenAI-compatible API that supports vision (LM Studio, Ollama, etc.)
         
         Args:
-            message: Message dict with optional 'image' and 'image_type' fields
+            message: Message dict with optional 'image' and 'image_type' fields;
+                the image may already be raw bytes (see filter_images_keep_latest)
             
         Returns:
             Formatted message dict for API
@@ -81,6 +229,17 @@ class LLMService:
             # No image, return as plain text message
             return {"role": message["role"], "content": message["content"]}
         
+        if Settings.VISION_IMAGE_BASE_URL:
+            # Let the upstream fetch the image instead of inlining base64 JSON
+            image = message['image']
+            data = image if isinstance(image, bytes) else base64.b64decode(image)
+            token = store_image(data, message['image_type'])
+            image_url = {"url": f"{Settings.VISION_IMAGE_BASE_URL}/api/vision/{token}"}
+        else:
+            image_url = {"url": f"data:{message['image_type']};base64,{message['image']}"}
+        if Settings.VISION_DETAIL:
+            image_url["detail"] = Settings.VISION_DETAIL
+        
         # Format with image using OpenAI's content array format
         return {
             "role": message["role"],
@@ -88,19 +247,49 @@ class LLMService:
                 {"type": "text", "text": message["content"]},
                 {
                     "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{message['image_type']};base64,{message['image']}"
-                    }
+                    "image_url": image_url
                 }
             ]
         }
     
+    @staticmethod
+    def _is_vision_error(error_text: str) -> bool:
+        """Return True if an upstream error looks like a vision/image rejection."""
+        return _VISION_ERR_RE.search(error_text) is not None
+    
+    @staticmethod
+    def _log_request_debug(payload: Dict):
+        """Log the outgoing request at DEBUG level, redacting the API key and image data."""
+        logger.debug(_BANNER)
+        logger.debug("🚀 MAKING LLM API REQUEST")
+        logger.debug("URL: %s/chat/completions", Settings.OPENAI_API_URL)
+        logger.debug("Method: POST")
+        logger.debug("Headers: %s", _REDACTED_HEADERS_JSON)
+        
+        # Log payload but truncate base64 image data for readability; only
+        # messages carrying images are copied, everything else is shared
+        debug_messages = []
+        for msg in payload.get('messages', []):
+            if isinstance(msg.get('content'), list):
+                items = []
+                for item in msg['content']:
+                    url = item.get('image_url', {}).get('url', '') if item.get('type') == 'image_url' else ''
+                    if len(url) > 100:
+                        item = {**item, 'image_url': {**item['image_url'], 'url': url[:100] + f"... ({len(url)} chars)"}}
+                    items.append(item)
+                msg = {**msg, 'content': items}
+            debug_messages.append(msg)
+        
+        logger.debug("Payload:")
+        logger.debug("%s", orjson.dumps({**payload, 'messages': debug_messages}, option=orjson.OPT_INDENT_2).decode())
+        logger.debug(_BANNER)
+    
     @staticmethod
     async def stream_completion(
         messages: List[Dict], 
         temperature: float = None,
         model: str = None
-    ) -> AsyncGenerator[str, None]:
+    ) -> AsyncGenerator[Tuple[bytes, str], None]:
         """
         Stream LLM response chunks from an OpenAI-compatible API.
         
@@ -116,8 +305,10 @@ class LLMService:
             model: Name of the LLM model to use
             
         Yields:
-            str: SSE-formatted data chunks ("data: {json}\n\n")
-                containing either content deltas or error messages
+            tuple: (frame, delta) where frame is the SSE-formatted chunk
+                (b"data: {json}\n\n") containing either a content delta or
+                an error message, and delta is the content text carried
+                by the frame ("" for errors) so callers need not re-parse it
                 
         Notes:
             - Handles streaming responses line-by-line
@@ -130,10 +321,13 @@ class LLMService:
         temperature = temperature or Settings.DEFAULT_TEMPERATURE
         model = model or Settings.DEFAULT_MODEL
         
-        logger.debug(f"Streaming: {len(messages)} messages → model={model}, temp={temperature}")
+        logger.debug("Streaming: %d messages → model=%s, temp=%s", len(messages), model, temperature)
         
-        # Filter images (keep only the most recent one)
-        messages = LLMService.filter_images_keep_latest(messages)
+        # Filter images (keep only the most recent one). Image decode/resize
+        # is CPU-bound, so when an image is kept it runs off the event loop;
+        # text-only turns skip the thread hop
+        if LLMService._last_image_index(messages) is not None:
+            messages = await asyncio.to_thread(LLMService.filter_images_keep_latest, messages)
         
         # Always format messages for vision API - assume all models support vision
         # If they don't, we'll catch the error and handle it gracefully
@@ -142,11 +336,6 @@ class LLMService:
             for msg in messages
         ]
         
-        headers = {
-            "Authorization": f"Bearer {Settings.OPENAI_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "model": model,
             "messages": formatted_messages,
@@ -155,90 +344,93 @@ class LLMService:
         }
         
         # Log the complete request details at DEBUG level
-        logger.debug("=" * 80)
-        logger.debug(f"🚀 MAKING LLM API REQUEST")
-        logger.debug(f"URL: {Settings.OPENAI_API_URL}/chat/completions")
-        logger.debug(f"Method: POST")
-        logger.debug(f"Headers: {json.dumps({k: v if k != 'Authorization' else f'Bearer ***{v[-4:]}' for k, v in headers.items()}, indent=2)}")
-        
-        # Log payload but truncate base64 image data for readability
-        debug_payload = json.loads(json.dumps(payload))
-        for msg in debug_payload.get('messages', []):
-            if isinstance(msg.get('content'), list):
-                for item in msg['content']:
-                    if item.get('type') == 'image_url' and 'image_url' in item:
-                        url = item['image_url'].get('url', '')
-                        if len(url) > 100:
-                            item['image_url']['url'] = url[:100] + f"... ({len(url)} chars)"
-        
-        logger.debug(f"Payload:")
-        logger.debug(json.dumps(debug_payload, indent=2))
-        logger.debug("=" * 80)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            LLMService._log_request_debug(payload)
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                logger.debug(f"Making request to {Settings.OPENAI_API_URL}/chat/completions")
+            client = LLMService.get_client()
+            if debug:
+                logger.debug("Making request to %s/chat/completions", Settings.OPENAI_API_URL)
+            
+            async with client.stream(
+                "POST",
+                f"{Settings.OPENAI_API_URL}/chat/completions",
+                headers=_REQUEST_HEADERS,
+                content=orjson.dumps(payload)
+            ) as response:
+                if debug:
+                    logger.debug(_BANNER_SHORT)
+                    logger.debug("📥 LLM API RESPONSE")
+                    logger.debug("Status: %s %s", response.status_code, response.reason_phrase)
+                    logger.debug("Headers: %s", orjson.dumps(dict(response.headers), option=orjson.OPT_INDENT_2).decode())
+                    logger.debug(_BANNER_SHORT)
                 
-                async with client.stream(
-                    "POST",
-                    f"{Settings.OPENAI_API_URL}/chat/completions",
-                    headers=headers,
-                    json=payload
-                ) as response:
-                    logger.debug("=" * 60)
-                    logger.debug(f"📥 LLM API RESPONSE")
-                    logger.debug(f"Status: {response.status_code} {response.reason_phrase}")
-                    logger.debug(f"Headers: {json.dumps(dict(response.headers), indent=2)}")
-                    logger.debug("=" * 60)
+                # Handle non-200 responses
+                if response.status_code != 200:
+                    try:
+                        error_content = await response.aread()
+                        error_text = error_content.decode('utf-8', errors='ignore')
+                    except Exception:
+                        error_text = "Could not read error response"
                     
-                    # Handle non-200 responses
-                    if response.status_code != 200:
-                        try:
-                            error_content = await response.aread()
-                            error_text = error_content.decode('utf-8', errors='ignore')
-                        except Exception:
-                            error_text = "Could not read error response"
-                        
-                        # Check for vision-related errors
-                        error_lower = error_text.lower()
-                        if any(keyword in error_lower for keyword in [
-                            'image', 'vision', 'multimodal', 'content type', 'invalid content',
-                            'content array', 'image_url', 'image_data', 'should be a valid string', 'input should be'
-                        ]):
-                            vision_error_msg = "The language model was unable to process your image. Removing."
-                            logger.warning(f"Model doesn't support vision (HTTP {response.status_code}): {error_text}")
-                            yield f"data: {json.dumps({'error': 'vision_not_supported', 'message': vision_error_msg, 'remove_images': True})}\n\n"
-                            return
-                        
-                        logger.error(f"❌ API error {response.status_code}: {error_text}")
-                        yield f"data: {json.dumps({'error': error_text})}\n\n"
+                    # Check for vision-related errors
+                    if LLMService._is_vision_error(error_text):
+                        vision_error_msg = "The language model was unable to process your image. Removing."
+                        logger.warning(f"Model doesn't support vision (HTTP {response.status_code}): {error_text}")
+                        yield sse_event({'error': 'vision_not_supported', 'message': vision_error_msg, 'remove_images': True}), ""
                         return
                     
-                    line_count = 0
-                    async for line in response.aiter_lines():
+                    logger.error(f"❌ API error {response.status_code}: {error_text}")
+                    yield sse_event({'error': error_text}), ""
+                    return
+                
+                line_count = 0
+                async for data in iter_sse_data(response.aiter_bytes()):
+                    if debug:
+                        # Only count lines when they are being logged
                         line_count += 1
-                        logger.debug(f"Received line {line_count}: {line[:100]}...")
-                        
-                        if line.startswith("data: "):
-                            data = line[6:]  # Remove "data: " prefix
-                            if data == "[DONE]":
-                                logger.debug("Stream completed with [DONE]")
-                                break
-                            
-                            try:
-                                chunk = json.loads(data)
-                                if "choices" in chunk and chunk["choices"]:
-                                    delta = chunk["choices"][0].get("delta", {})
-                                    if "content" in delta:
-                                        content = delta["content"]
-                                        logger.debug(f"Yielding content: {repr(content)}")
-                                        yield f"data: {json.dumps({'content': content})}\n\n"
-                            except json.JSONDecodeError as e:
-                                logger.warning(f"Failed to parse JSON chunk: {data} - Error: {e}")
-                                continue
+                        logger.debug("data line %d: %.100r", line_count, data)
                     
-                    logger.debug(f"Stream completed: {line_count} lines received")
-                                
+                    if data == b"[DONE]":
+                        logger.debug("Stream completed with [DONE]")
+                        break
+                    
+                    # Lift the content string straight out of the raw bytes;
+                    # only escaped strings need decoding for the delta text
+                    match = _CONTENT_RE.search(data)
+                    if match:
+                        escaped = match.group(1)
+                        try:
+                            if b"\\" in escaped:
+                                content = orjson.loads(b'"' + escaped + b'"')
+                            else:
+                                content = escaped.decode()
+                        except (orjson.JSONDecodeError, UnicodeDecodeError):
+                            pass
+                        else:
+                            if debug:
+                                logger.debug("Yielding content: %r", content)
+                            yield sse_content_raw(escaped), content
+                            continue
+                    
+                    try:
+                        chunk = orjson.loads(data)
+                        if "choices" in chunk and chunk["choices"]:
+                            delta = chunk["choices"][0].get("delta") or {}
+                            content = delta.get("content")
+                            # Tool-call and role chunks carry "content": null
+                            if isinstance(content, str):
+                                if debug:
+                                    logger.debug("Yielding content: %r", content)
+                                yield sse_content(content), content
+                    except orjson.JSONDecodeError as e:
+                        logger.warning(f"Failed to parse JSON chunk: {data} - Error: {e}")
+                        continue
+                
+                if debug:
+                    logger.debug("Stream completed: %d data lines received", line_count)
+                            
         except httpx.HTTPStatusError as e:
             # Read the response content properly for streaming responses
             try:
@@ -251,30 +443,23 @@ class LLMService:
                 error_text = "Could not read error response"
             
             # Check for vision-related errors
-            error_lower = error_text.lower()
-            if any(keyword in error_lower for keyword in [
-                'image', 'vision', 'multimodal', 'content type', 'invalid content',
-                'content array', 'image_url', 'image_data', 'should be a valid string'
-            ]):
+            if LLMService._is_vision_error(error_text):
                 vision_error_msg = "This model does not support image inputs. The image has been removed from the conversation."
                 logger.warning(f"Model doesn't support vision: {error_text}")
-                yield f"data: {json.dumps({'error': 'vision_not_supported', 'message': vision_error_msg, 'remove_images': True})}\n\n"
+                yield sse_event({'error': 'vision_not_supported', 'message': vision_error_msg, 'remove_images': True}), ""
                 return
             
             error_msg = f"HTTP error {e.response.status_code}: {error_text}"
             logger.error(error_msg)
-            yield f"data: {json.dumps({'error': error_msg})}\n\n"
+            yield sse_event({'error': error_msg}), ""
         except Exception as e:
             # Check if it's a vision-related exception
-            error_str = str(e).lower()
-            if any(keyword in error_str for keyword in [
-                'image', 'vision', 'multimodal', 'content type', 'invalid content', 'should be a valid string'
-            ]):
+            if LLMService._is_vision_error(str(e)):
                 vision_error_msg = "This model does not support image inputs. The image has been removed from the conversation."
                 logger.warning(f"Model doesn't support vision: {str(e)}")
-                yield f"data: {json.dumps({'error': 'vision_not_supported', 'message': vision_error_msg, 'remove_images': True})}\n\n"
+                yield sse_event({'error': 'vision_not_supported', 'message': vision_error_msg, 'remove_images': True}), ""
                 return
             
             error_msg = f"Unexpected error: {str(e)}"
-            logger.error(f"{error_msg}\n{traceback.format_exc()}")
-            yield f"data: {json.dumps({'error': error_msg})}\n\n"
+            logger.exception(error_msg)
+            yield sse_event({'error': error_msg}), ""
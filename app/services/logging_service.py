@@ -1,17 +1,25 @@
 """Logging service for conversation tracking."""
 
 import asyncio
-import json
+import hashlib
 import logging
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional
+
+import aiofiles
+import orjson
 
 from app.config import Settings
 
 logger = logging.getLogger("tinychat")
 
-# File lock for thread-safe logging
-_log_lock = asyncio.Lock()
+# Bounded queue of pending log entries drained by a single writer task
+_log_queue: asyncio.Queue = asyncio.Queue(maxsize=Settings.CHAT_LOG_QUEUE_SIZE)
+_writer_task: Optional[asyncio.Task] = None
+_dropped_entries = 0
+
+# Maximum number of entries appended per write
+_LOG_BATCH_SIZE = 100
 
 
 class LoggingService:
@@ -31,8 +39,10 @@ class LoggingService:
         assistant response, model, and temperature to the configured log file.
         Only logs if CHAT_LOG environment variable is set.
         
-        Uses an async lock to ensure thread-safe writes when multiple
-        conversations are happening concurrently.
+        Entries are pushed onto a bounded queue that a single background
+        writer drains in batches, so no task is created and no file is
+        opened per request. When the queue is full the entry is dropped
+        and counted rather than blocking.
         
         Args:
             messages: Full conversation history from the request
@@ -40,43 +50,116 @@ class LoggingService:
             model: The model used for generation
             temperature: The temperature setting used
         """
+        global _dropped_entries
         if not Settings.CHAT_LOG:
             return
         
-        # Schedule the async write operation
-        asyncio.create_task(
-            LoggingService._async_log_conversation(
-                messages, assistant_response, model, temperature
-            )
-        )
+        LoggingService._ensure_writer()
+        log_entry = {
+            "timestamp": datetime.now().isoformat(),
+            "model": model,
+            "temperature": temperature,
+            "messages": LoggingService._sanitize_messages(messages),
+            "assistant_response": assistant_response
+        }
+        try:
+            _log_queue.put_nowait(log_entry)
+        except asyncio.QueueFull:
+            _dropped_entries += 1
+            logger.warning(f"Conversation log queue full, dropping entry ({_dropped_entries} dropped)")
     
     @staticmethod
-    async def _async_log_conversation(
-        messages: List[Dict], 
-        assistant_response: str, 
-        model: str, 
-        temperature: float
-    ):
+    def _sanitize_messages(messages: List[Dict]) -> List[Dict]:
         """
-        Internal async function to perform thread-safe logging.
+        Replace base64 image payloads with a short fingerprint for logging.
         
-        Uses an asyncio.Lock to ensure only one write happens at a time,
-        preventing file corruption from concurrent requests.
+        Keeps log lines small in multi-turn vision chats and avoids holding
+        the image strings in the queue. Messages without images are shared,
+        not copied.
+        
+        Args:
+            messages: Conversation history from the request
+            
+        Returns:
+            Messages with each 'image' replaced by {"sha256": ..., "bytes": ...}
         """
-        async with _log_lock:
-            try:
-                log_entry = {
-                    "timestamp": datetime.now().isoformat(),
-                    "model": model,
-                    "temperature": temperature,
-                    "messages": messages,
-                    "assistant_response": assistant_response
+        sanitized = []
+        for msg in messages:
+            image = msg.get('image')
+            if isinstance(image, str) and image:
+                msg = {
+                    **msg,
+                    'image': {
+                        "sha256": hashlib.sha256(image.encode('ascii', 'ignore')).hexdigest()[:16],
+                        "bytes": len(image)
+                    }
                 }
-                
-                # Append to JSONL file (one JSON object per line)
-                with open(Settings.CHAT_LOG, 'a', encoding='utf-8') as f:
-                    f.write(json.dumps(log_entry, ensure_ascii=False) + '\n')
-                
-                logger.debug(f"Logged conversation to {Settings.CHAT_LOG}")
-            except Exception as e:
-                logger.error(f"Failed to log conversation: {e}")
+            sanitized.append(msg)
+        return sanitized
+    
+    @staticmethod
+    def get_dropped_entries() -> int:
+        """Get number of log entries dropped because the queue was full."""
+        return _dropped_entries
+    
+    @staticmethod
+    async def shutdown(timeout: float = 5.0):
+        """
+        Flush queued log entries and stop the writer (called on application shutdown).
+        
+        Args:
+            timeout: Maximum seconds to wait for pending entries to be written
+        """
+        global _writer_task
+        if _writer_task is None:
+            return
+        try:
+            await asyncio.wait_for(_log_queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Timed out flushing conversation log ({_log_queue.qsize()} entries not written)")
+        _writer_task.cancel()
+        _writer_task = None
+        if _dropped_entries:
+            logger.warning(f"Conversation log dropped {_dropped_entries} entries because the queue was full")
+    
+    @staticmethod
+    def _ensure_writer():
+        """Start the background writer task if it is not already running."""
+        global _writer_task
+        if _writer_task is None or _writer_task.done():
+            _writer_task = asyncio.create_task(LoggingService._writer_loop())
+    
+    @staticmethod
+    async def _writer_loop():
+        """
+        Background task that drains the log queue.
+        
+        Takes whatever is queued (up to _LOG_BATCH_SIZE entries) and appends
+        it in one write. Being the only writer, it serializes appends to the
+        log file without needing a lock.
+        """
+        while True:
+            batch = [await _log_queue.get()]
+            while len(batch) < _LOG_BATCH_SIZE and not _log_queue.empty():
+                batch.append(_log_queue.get_nowait())
+            try:
+                await LoggingService._write_entries(batch)
+            finally:
+                for _ in batch:
+                    _log_queue.task_done()
+    
+    @staticmethod
+    async def _write_entries(entries: List[Dict]):
+        """Internal async function to append a batch of entries to the log file."""
+        try:
+            # Append to JSONL file (one JSON object per line) without
+            # blocking the event loop on the write syscall
+            lines = b"".join(
+                orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE) for entry in entries
+            )
+            async with aiofiles.open(Settings.CHAT_LOG, 'ab') as f:
+                await f.write(lines)
+            
+            logger.debug("Logged %d conversations to %s", len(entries), Settings.CHAT_LOG)
+        except Exception as e:
+            logger.error(f"Failed to log conversation: {e}")
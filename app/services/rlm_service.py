@@ -1,24 +1,160 @@
 """RLM (Recursive Language Models) service for code execution capabilities."""
 
 import asyncio
-import json
+import concurrent.futures
+import functools
 import logging
-import queue
 import re
 import threading
 import time
-import traceback
-from typing import AsyncGenerator, Dict, List
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncGenerator, Dict, Iterable, List, Optional, Tuple
 
 from app.config import Settings
+from app.utils.state import hold_rlm_slot_until
+from app.utils.sse import sse_content, sse_event
 
 logger = logging.getLogger("tinychat")
 
-# Check if RLM is available
-if Settings.HAS_RLM:
+# Constant frames sent at the start of every RLM stream
+_RLM_STARTUP = '> [RLM Startup...]\n\n'
+_RLM_THINKING = '🧠 *RLM is thinking...*\n\n'
+_SSE_RLM_MISSING = sse_event({'error': 'RLM module not installed'})
+_SSE_RLM_STARTUP = sse_content(_RLM_STARTUP)
+_SSE_RLM_THINKING = sse_content(_RLM_THINKING)
+
+# Bounded pool for RLM workers, sized to the RLM concurrency limit. Workers
+# abandoned by their request stay counted against that limit until they
+# return (see hold_rlm_slot_until), so an admitted request always has a thread
+_rlm_executor = ThreadPoolExecutor(
+    max_workers=Settings.MAX_CONCURRENT_RLM,
+    thread_name_prefix="rlm-worker"
+)
+
+# Max RLM messages buffered for a slow client before the worker blocks
+_RLM_QUEUE_SIZE = 64
+# Status messages are dropped rather than waited on past this many seconds
+_RLM_STATUS_PUT_TIMEOUT = 5.0
+
+# FINAL()/FINAL_VAR() macros in model reasoning
+_FINAL_RE = re.compile(r'FINAL(?:_VAR)?\((.*?)\)')
+
+# Markdown templates for the streamed thinking display
+_ITER_HEADER_TMPL = "\n\n---\n#### 🧠 Iteration {n} Thinking\n"
+_ITER_BRIEF_TMPL = "Iteration {n}..."
+_REASONING_TMPL = "\n> **Reasoning:**\n> {reasoning}\n"
+_CODE_BLOCK_TMPL = (
+    "\n> **REPL Code:**\n> ```python\n> {code}\n> ```\n"
+    "> **Result:**\n> ```\n> {stdout}\n> ```\n"
+)
+_FINAL_ANSWER_HEADER = "\n\n---\n### ✅ Final Answer\n\n"
+
+# Separator between values when resolving several REPL variables at once
+_RESOLVE_SEP = '\x01'
+
+
+@functools.lru_cache(maxsize=16)
+def _get_rlm(model: str, api_key: str, base_url: str, thread_id: int):
+    """
+    Get the pooled RLM instance for a model, credentials and worker thread.
+    
+    Construction happens once per key; each request still gets its own
+    completion context via _spawn_completion_context. RLM makes no
+    thread-safety guarantees, so instances are also keyed by worker thread
+    and never shared between concurrent requests (the pool has at most
+    MAX_CONCURRENT_RLM threads).
+    """
     from rlm import RLM
-    from rlm.utils.parsing import find_final_answer, format_iteration
-    from rlm.utils.prompts import build_user_prompt
+    
+    return RLM(
+        backend="openai",
+        backend_kwargs={
+            "model_name": model,
+            "api_key": api_key,
+            "base_url": base_url,
+        },
+        verbose=False,
+    )
+
+
+def _quote(text: str) -> str:
+    """Continue a markdown blockquote across every line of text."""
+    return text.replace('\n', '\n> ') if '\n' in text else text
+
+
+def _clean_ref(val_str: str) -> str:
+    """Strip whitespace and quotes from a variable reference."""
+    return val_str.strip().strip('"').strip("'")
+
+
+def _smart_output_candidate(code: str) -> Optional[Tuple[str, bool]]:
+    """
+    Find the variable whose value should stand in for a silent code block.
+    
+    Args:
+        code: Source of a REPL code block that printed nothing
+        
+    Returns:
+        (name, is_assignment) for the last line's target, or None
+    """
+    lines = [l for l in code.strip().split('\n') if l.strip()]
+    if not lines:
+        return None
+    last_line = lines[-1].strip()
+    if '=' in last_line and not any(
+        last_line.startswith(p) for p in ['if ', 'for ', 'while ', 'def ', 'class ']
+    ):
+        part = last_line.split('=')[0].strip()
+        var_name = part.split(':')[-1].strip() if ':' in part else part
+        if var_name.isidentifier():
+            return var_name, True
+    elif last_line.isidentifier():
+        return last_line, False
+    return None
+
+
+def _resolve_values(environment, names: Iterable[str]) -> Dict[str, str]:
+    """
+    Resolve REPL variable names to their printed values.
+    
+    Names found in the environment's locals are read directly; the rest are
+    printed in a single execute_code round-trip. If that batch fails (e.g.
+    one name is undefined) each name is retried on its own.
+    
+    Args:
+        environment: RLM REPL environment
+        names: Candidate variable names
+        
+    Returns:
+        dict: Mapping of each resolvable name to its value
+    """
+    resolved = {}
+    pending = []
+    for name in dict.fromkeys(names):
+        if not name.isidentifier():
+            continue
+        if hasattr(environment, 'locals') and name in environment.locals:
+            resolved[name] = str(environment.locals[name])
+        else:
+            pending.append(name)
+    
+    if not pending or not hasattr(environment, 'execute_code'):
+        return resolved
+    
+    try:
+        cr = environment.execute_code(f"print({', '.join(pending)}, sep={_RESOLVE_SEP!r})")
+        values = cr.stdout.split(_RESOLVE_SEP) if not cr.stderr else []
+        if len(values) == len(pending):
+            resolved.update(zip(pending, (v.strip() for v in values)))
+            return resolved
+        
+        for name in pending:
+            cr = environment.execute_code(f"print({name})")
+            if not cr.stderr:
+                resolved[name] = cr.stdout.strip()
+    except Exception as e:
+        logger.debug("Error resolving variable value: %s", e)
+    return resolved
 
 
 class RLMService:
@@ -29,7 +165,7 @@ class RLMService:
         messages: List[Dict],
         model: str,
         show_thinking: bool = True
-    ) -> AsyncGenerator[str, None]:
+    ) -> AsyncGenerator[Tuple[bytes, str], None]:
         """
         Stream RLM completion with code execution.
         
@@ -39,58 +175,70 @@ class RLMService:
             show_thinking: Whether to stream the thinking process
             
         Yields:
-            SSE-formatted data chunks
+            tuple: (frame, delta) where frame is the SSE-formatted chunk as
+                bytes and delta is the content text it carries ("" if none)
         """
         if not Settings.HAS_RLM:
-            yield f"data: {json.dumps({'error': 'RLM module not installed'})}\n\n"
+            yield _SSE_RLM_MISSING, ""
             return
         
+        # Imported on first RLM request so servers that never use it don't pay for it
+        from rlm.utils.parsing import find_final_answer, format_iteration
+        from rlm.utils.prompts import build_user_prompt
+        
         logger.info(f"RLM generation request for model: {model}")
         
         # Always send a startup indicator
         if show_thinking:
-            thinking_msg = json.dumps({'content': '> [RLM Startup...]\n\n'})
-            yield f"data: {thinking_msg}\n\n"
+            yield _SSE_RLM_STARTUP, _RLM_STARTUP
         else:
-            thinking_msg = json.dumps({'content': '🧠 *RLM is thinking...*\n\n'})
-            yield f"data: {thinking_msg}\n\n"
-        
-        # Prepare RLM
-        rlm_inst = RLM(
-            backend="openai",
-            backend_kwargs={
-                "model_name": model,
-                "api_key": Settings.OPENAI_API_KEY,
-                "base_url": Settings.OPENAI_API_URL,
-            },
-            verbose=False,
-        )
+            yield _SSE_RLM_THINKING, _RLM_THINKING
         
         rlm_query = messages[-1]["content"] if messages else ""
-        message_queue = queue.Queue()  # Thread-safe queue
-        thread_done = threading.Event()
+        loop = asyncio.get_running_loop()
+        message_queue: asyncio.Queue = asyncio.Queue(maxsize=_RLM_QUEUE_SIZE)
         cancellation_requested = threading.Event()
-        start_time = time.time()
+        start_time = time.monotonic()
+        
+        def post_message(msg):
+            """
+            Hand a message from the worker thread to the event loop.
+            
+            The queue is bounded, so a slow client makes the worker block
+            here instead of buffering without limit. Status messages give up
+            after _RLM_STATUS_PUT_TIMEOUT; everything else waits until it is
+            delivered or the consumer has gone away.
+            """
+            put = message_queue.put(msg)
+            try:
+                future = asyncio.run_coroutine_threadsafe(put, loop)
+            except RuntimeError:
+                # Event loop already closed; nobody is listening
+                put.close()
+                return
+            droppable = msg is not None and msg["type"] in ("status", "brief_status")
+            waited = 0.0
+            while True:
+                try:
+                    future.result(timeout=0.5)
+                    return
+                except concurrent.futures.TimeoutError:
+                    waited += 0.5
+                    if cancellation_requested.is_set() or (droppable and waited >= _RLM_STATUS_PUT_TIMEOUT):
+                        future.cancel()
+                        return
         
         def rlm_worker(show_thinking_mode):
             try:
+                rlm_inst = _get_rlm(
+                    model, Settings.OPENAI_API_KEY, Settings.OPENAI_API_URL, threading.get_ident()
+                )
                 with rlm_inst._spawn_completion_context(rlm_query) as (lm_handler, environment):
                     message_history = rlm_inst._setup_prompt(rlm_query)
                     for i in range(rlm_inst.max_iterations):
-                        # Check for cancellation
+                        # Stop between iterations once the consumer has given
+                        # up (timeout or client disconnect); it owns the deadline
                         if cancellation_requested.is_set():
-                            message_queue.put({
-                                "type": "error", 
-                                "content": f"RLM execution cancelled (timeout: {Settings.RLM_TIMEOUT}s)"
-                            })
-                            return
-                        
-                        # Check timeout
-                        if time.time() - start_time > Settings.RLM_TIMEOUT:
-                            message_queue.put({
-                                "type": "error", 
-                                "content": f"RLM timeout after {Settings.RLM_TIMEOUT}s"
-                            })
                             return
                         
                         # Determine counts
@@ -108,14 +256,14 @@ class RLMService:
                         
                         # Send status
                         if show_thinking_mode:
-                            message_queue.put({
+                            post_message({
                                 "type": "status",
-                                "content": f"\n\n---\n#### 🧠 Iteration {i+1} Thinking\n"
+                                "content": _ITER_HEADER_TMPL.format(n=i + 1)
                             })
                         else:
-                            message_queue.put({
+                            post_message({
                                 "type": "brief_status",
-                                "content": f"Iteration {i+1}..."
+                                "content": _ITER_BRIEF_TMPL.format(n=i + 1)
                             })
                         
                         iteration = rlm_inst._completion_turn(
@@ -125,67 +273,69 @@ class RLMService:
                         )
                         
                         # Format reasoning
-                        reasoning_styled = iteration.response.replace('\n', '\n> ')
+                        reasoning_styled = _quote(iteration.response)
                         
                         # Gather execution outputs
-                        execution_outputs = ""
-                        for cb in iteration.code_blocks:
-                            if cb.result.stdout:
-                                execution_outputs += cb.result.stdout + "\n"
+                        execution_outputs = "".join(
+                            cb.result.stdout + "\n"
+                            for cb in iteration.code_blocks
+                            if cb.result.stdout
+                        )
+                        
+                        # Collect every variable this iteration needs resolved
+                        # (FINAL() references and silent code blocks) so they
+                        # can be looked up in one REPL round-trip
+                        final_refs = _FINAL_RE.findall(reasoning_styled) if 'FINAL' in reasoning_styled else []
+                        candidates = [
+                            _smart_output_candidate(cb.code)
+                            if cb.code.strip() and not cb.result.stdout and not cb.result.stderr
+                            else None
+                            for cb in iteration.code_blocks
+                        ]
+                        resolved = _resolve_values(
+                            environment,
+                            [_clean_ref(ref) for ref in final_refs] + [c[0] for c in candidates if c]
+                        )
                         
-                        # Resolve variables in reasoning
                         def _resolve_val(val_str):
-                            v = val_str.strip().strip('"').strip("'")
-                            if v.isidentifier():
-                                if hasattr(environment, 'locals') and v in environment.locals:
-                                    return str(environment.locals[v])
-                                elif hasattr(environment, 'execute_code'):
-                                    cr = environment.execute_code(f"print({v})")
-                                    if not cr.stderr:
-                                        return cr.stdout.strip()
-                            return v
+                            v = _clean_ref(val_str)
+                            return resolved.get(v, v)
                         
-                        reasoning_styled = re.sub(
-                            r'FINAL(?:_VAR)?\((.*?)\)',
-                            lambda m: f"**{_resolve_val(m.group(1))}**",
-                            reasoning_styled
-                        )
+                        # Resolve variables in reasoning
+                        if final_refs:
+                            reasoning_styled = _FINAL_RE.sub(
+                                lambda m: f"**{_resolve_val(m.group(1))}**",
+                                reasoning_styled
+                            )
                         
-                        update = f"\n> **Reasoning:**\n> {reasoning_styled}\n"
-                        for cb in iteration.code_blocks:
+                        # Post reasoning and each code block as separate
+                        # updates so the UI renders them as they are ready
+                        post_message({
+                            "type": "update",
+                            "content": _REASONING_TMPL.format(reasoning=reasoning_styled)
+                        })
+                        for cb, candidate in zip(iteration.code_blocks, candidates):
                             if cb.code.strip():
-                                code_styled = cb.code.replace('\n', '\n> ')
-                                stdout_styled = str(cb.result.stdout).replace('\n', '\n> ') if cb.result.stdout else ''
+                                code_styled = _quote(cb.code)
+                                stdout_styled = _quote(str(cb.result.stdout)) if cb.result.stdout else ''
                                 
                                 # Smart output capture
-                                if not stdout_styled and not cb.result.stderr:
-                                    try:
-                                        lines = [l for l in cb.code.strip().split('\n') if l.strip()]
-                                        if lines:
-                                            last_line = lines[-1].strip()
-                                            if '=' in last_line and not any(
-                                                last_line.startswith(p) for p in ['if ', 'for ', 'while ', 'def ', 'class ']
-                                            ):
-                                                part = last_line.split('=')[0].strip()
-                                                var_name = part.split(':')[-1].strip() if ':' in part else part
-                                                if var_name.isidentifier():
-                                                    val = _resolve_val(var_name)
-                                                    if val != var_name:
-                                                        stdout_styled = f"[Variable {var_name} = {val}]"
-                                            elif last_line.isidentifier():
-                                                val = _resolve_val(last_line)
-                                                if val != last_line:
-                                                    stdout_styled = f"[Value = {val}]"
-                                    except Exception as e:
-                                        logger.debug(f"Error resolving variable value: {e}")
+                                if candidate:
+                                    name, is_assignment = candidate
+                                    val = _resolve_val(name)
+                                    if val != name:
+                                        if is_assignment:
+                                            stdout_styled = f"[Variable {name} = {val}]"
+                                        else:
+                                            stdout_styled = f"[Value = {val}]"
                                 
                                 if not stdout_styled:
                                     stdout_styled = '[No Output]'
                                 
-                                update += f"\n> **REPL Code:**\n> ```python\n> {code_styled}\n> ```\n"
-                                update += f"> **Result:**\n> ```\n> {stdout_styled}\n> ```\n"
-                        
-                        message_queue.put({"type": "update", "content": update})
+                                post_message({
+                                    "type": "update",
+                                    "content": _CODE_BLOCK_TMPL.format(code=code_styled, stdout=stdout_styled)
+                                })
                         
                         final_answer = find_final_answer(iteration.response, environment=environment)
                         
@@ -204,61 +354,66 @@ class RLMService:
                             if isinstance(final_answer, str):
                                 final_answer = final_answer.strip().strip('"').strip("'")
                                 
-                                # Smart variable resolution
+                                # Smart variable resolution, reusing values
+                                # already looked up for this iteration
                                 if final_answer.isidentifier():
-                                    if hasattr(environment, 'locals') and final_answer in environment.locals:
-                                        final_answer = str(environment.locals[final_answer])
-                                    elif hasattr(environment, 'execute_code'):
-                                        check_res = environment.execute_code(f"print({final_answer})")
-                                        if not check_res.stderr:
-                                            final_answer = check_res.stdout.strip()
+                                    if final_answer not in resolved:
+                                        resolved.update(_resolve_values(environment, [final_answer]))
+                                    final_answer = resolved.get(final_answer, final_answer)
                             
-                            message_queue.put({"type": "final", "content": final_answer})
+                            post_message({"type": "final", "content": final_answer})
                             return
                         
                         # Format for next turn
                         message_history.extend(format_iteration(iteration))
             except Exception as e:
-                logger.error(f"RLM Worker Exception: {str(e)}\n{traceback.format_exc()}")
-                message_queue.put({"type": "error", "content": f"RLM Worker Error: {str(e)}"})
+                logger.exception("RLM Worker Exception: %s", e)
+                post_message({"type": "error", "content": f"RLM Worker Error: {str(e)}"})
             finally:
-                thread_done.set()
-        
-        # Start worker thread
-        worker_thread = threading.Thread(target=rlm_worker, args=(show_thinking,), daemon=True)
-        worker_thread.start()
+                # Sentinel: worker is done
+                post_message(None)
         
-        assistant_full_content = ""
+        # Run worker on the bounded RLM pool
+        worker = loop.run_in_executor(_rlm_executor, rlm_worker, show_thinking)
         
-        # Process messages with timeout
-        while not thread_done.is_set() or not message_queue.empty():
-            try:
-                msg = message_queue.get(timeout=0.1)
+        # Process messages as the worker posts them, until the sentinel or
+        # deadline. The deadline is applied per get() rather than with
+        # asyncio.timeout() so it never fires while suspended at a yield.
+        deadline = start_time + Settings.RLM_TIMEOUT
+        try:
+            while True:
+                try:
+                    msg = await asyncio.wait_for(
+                        message_queue.get(),
+                        timeout=max(deadline - time.monotonic(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    logger.warning(f"RLM timeout detected after {Settings.RLM_TIMEOUT}s")
+                    yield sse_event({'error': f'RLM execution timeout ({Settings.RLM_TIMEOUT}s)'}), ""
+                    break
+                
+                if msg is None:
+                    # The worker posts the sentinel last, so its thread is
+                    # about to return; wait so the slot frees with it
+                    await worker
+                    break
+                
                 if msg["type"] in ["status", "update"]:
                     if show_thinking:
-                        yield f"data: {json.dumps({'content': msg['content']})}\n\n"
-                        assistant_full_content += msg['content']
+                        yield sse_content(msg['content']), msg['content']
                 elif msg["type"] == "brief_status":
-                    yield f"data: {json.dumps({'rlm_status': msg['content']})}\n\n"
+                    yield sse_event({'rlm_status': msg['content']}), ""
                 elif msg["type"] == "final":
                     final_msg = msg['content']
                     if show_thinking:
-                        final_answer_header = f"\n\n---\n### ✅ Final Answer\n\n"
-                        yield f"data: {json.dumps({'content': final_answer_header + final_msg})}\n\n"
-                        assistant_full_content += final_answer_header + final_msg
-                    else:
-                        yield f"data: {json.dumps({'content': final_msg})}\n\n"
-                        assistant_full_content += final_msg
+                        final_msg = _FINAL_ANSWER_HEADER + final_msg
+                    yield sse_content(final_msg), final_msg
                 elif msg["type"] == "error":
-                    yield f"data: {json.dumps({'error': msg['content']})}\n\n"
-            except queue.Empty:
-                # Check for timeout
-                if time.time() - start_time > Settings.RLM_TIMEOUT:
-                    if not cancellation_requested.is_set():
-                        cancellation_requested.set()
-                        logger.warning(f"RLM timeout detected after {Settings.RLM_TIMEOUT}s")
-                    if not thread_done.is_set():
-                        await asyncio.sleep(0.5)
-                    yield f"data: {json.dumps({'error': f'RLM execution timeout ({Settings.RLM_TIMEOUT}s)'})}\n\n"
-                    break
-                await asyncio.sleep(0.1)
+                    yield sse_event({'error': msg['content']}), ""
+        finally:
+            # Single cancellation signal for the worker, on every exit path
+            cancellation_requested.set()
+            if not worker.done():
+                # The thread may still be inside a model call; keep it
+                # counted against MAX_CONCURRENT_RLM until it returns
+                hold_rlm_slot_until(worker)
@@ -10,28 +10,41 @@ from app.config import Settings
 
 logger = logging.getLogger("tinychat")
 
+# Field whose validator reports "Message content too long"
+_MESSAGES_FIELD = "messages"
+
+# Settings are fixed once the environment is loaded, so read them once
+_MAX_MSG_LEN = Settings.MAX_MESSAGE_LENGTH
+
 
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     """
     Convert Pydantic request validation errors into clearer JSON messages
     (e.g., when a message exceeds MAX_MESSAGE_LENGTH).
     """
-    errors = exc.errors()
-    # Look for specific message-too-long validation and return a friendly error
-    for err in errors:
+    # Single pass: return the friendly message-too-long error as soon as it
+    # is seen, otherwise collect the summarized errors along the way
+    simplified = []
+    for err in exc.errors():
         msg = err.get("msg", "")
         loc = err.get("loc", [])
-        if "Message content too long" in msg:
-            detail = msg
+        # Only the messages field can carry the too-long error. Pydantic
+        # prefixes validator messages ("Value error, ..."), so this is a
+        # substring check rather than startswith
+        if loc and loc[-1] == _MESSAGES_FIELD and "Message content too long" in msg:
             return JSONResponse(status_code=422, content={
                 "error": "MessageTooLong",
-                "detail": detail,
-                "max_message_length": Settings.MAX_MESSAGE_LENGTH,
+                "detail": msg,
+                "max_message_length": _MAX_MSG_LEN,
                 "location": loc,
             })
+        simplified.append({"loc": loc, "msg": msg})
+    
+    # Fallback: return summarized validation errors. The level check keeps
+    # the field list from being formatted when debug logging is off
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Validation failed for %s: %s", request.url.path, [e["loc"] for e in simplified])
     
-    # Fallback: return summarized validation errors
-    simplified = [{"loc": e.get("loc"), "msg": e.get("msg")} for e in errors]
     return JSONResponse(
         status_code=422, 
         content={"error": "ValidationError", "detail": simplified}
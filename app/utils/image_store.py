@@ -0,0 +1,60 @@
+"""Short-lived in-memory store for vision images served to the LLM by URL."""
+
+import secrets
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+# Images only need to live long enough for the upstream API to fetch them
+_IMAGE_TTL_SECONDS = 300.0
+_MAX_IMAGES = 32
+
+# token -> (expiry, image bytes, media type), oldest first
+_images: "OrderedDict[str, Tuple[float, bytes, str]]" = OrderedDict()
+
+
+def _evict_expired(now: float):
+    """Drop expired entries from the front of the store."""
+    while _images:
+        token, (expires, _, _) = next(iter(_images.items()))
+        if expires > now:
+            break
+        del _images[token]
+
+
+def store_image(data: bytes, media_type: str) -> str:
+    """
+    Store image bytes and return an unguessable token for fetching them.
+    
+    Args:
+        data: Raw image bytes
+        media_type: MIME type of the image
+        
+    Returns:
+        str: URL-safe token identifying the image
+    """
+    now = time.monotonic()
+    _evict_expired(now)
+    while len(_images) >= _MAX_IMAGES:
+        _images.popitem(last=False)
+    
+    token = secrets.token_urlsafe(32)
+    _images[token] = (now + _IMAGE_TTL_SECONDS, data, media_type)
+    return token
+
+
+def get_image(token: str) -> Optional[Tuple[bytes, str]]:
+    """
+    Look up a stored image.
+    
+    Args:
+        token: Token returned by store_image
+        
+    Returns:
+        tuple: (image bytes, media type), or None if unknown or expired
+    """
+    _evict_expired(time.monotonic())
+    entry = _images.get(token)
+    if entry is None:
+        return None
+    return entry[1], entry[2]
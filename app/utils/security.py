@@ -5,6 +5,33 @@ from fastapi.responses import JSONResponse
 
 from app.config import Settings
 
+# Settings are fixed once the environment is loaded, so read this once
+_DEBUG = Settings.ENABLE_DEBUG_LOGS
+
+# Generic error messages for production, indexed by status_code - 400
+_GENERIC_4XX = (
+    "Invalid request",    # 400
+    "Unauthorized",       # 401
+    None,                 # 402
+    "Forbidden",          # 403
+    "Not found",          # 404
+    *([None] * 24),       # 405-428
+    "Too many requests",  # 429
+)
+_GENERIC_500 = "Internal server error"
+_GENERIC_FALLBACK = "Request failed"
+
+
+def _msg_for(code: int) -> str:
+    """Return the generic production message for an HTTP status code."""
+    if 400 <= code <= 429:
+        msg = _GENERIC_4XX[code - 400]
+        if msg:
+            return msg
+    elif code == 500:
+        return _GENERIC_500
+    return _GENERIC_FALLBACK
+
 
 def get_client_ip(request: Request) -> str:
     """
@@ -19,11 +46,19 @@ def get_client_ip(request: Request) -> str:
     Returns:
         str: The client's IP address, or "unknown" if unavailable
     """
-    forwarded = request.headers.get("x-forwarded-for")
+    get_header = request.headers.get
+    forwarded = get_header("x-forwarded-for")
     if forwarded:
-        return forwarded.split(',')[0].strip()
+        # First hop only; avoid splitting the whole proxy chain
+        i = forwarded.find(',')
+        first = forwarded if i < 0 else forwarded[:i]
+        # Most proxies send the first hop without surrounding whitespace
+        # (every ASCII whitespace character sorts at or below the space)
+        if first and first[0] > ' ' and first[-1] > ' ':
+            return first
+        return first.strip()
     
-    real_ip = request.headers.get("x-real-ip")
+    real_ip = get_header("x-real-ip")
     if real_ip:
         return real_ip.strip()
     
@@ -44,22 +79,13 @@ def safe_error_response(message: str, status_code: int = 400):
     Returns:
         JSONResponse: A safe error response object
     """
-    if Settings.ENABLE_DEBUG_LOGS:
+    if _DEBUG:
         return JSONResponse(
             status_code=status_code,
             content={"error": message, "debug": True}
         )
     else:
-        # Generic error messages for production
-        generic_messages = {
-            400: "Invalid request",
-            401: "Unauthorized",
-            403: "Forbidden",
-            404: "Not found",
-            429: "Too many requests",
-            500: "Internal server error"
-        }
         return JSONResponse(
             status_code=status_code,
-            content={"error": generic_messages.get(status_code, "Request failed")}
+            content={"error": _msg_for(status_code)}
         )
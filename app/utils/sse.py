@@ -0,0 +1,163 @@
+"""Server-Sent Events framing helpers."""
+
+import asyncio
+import contextlib
+from typing import AsyncGenerator, AsyncIterator, List, Tuple
+
+import orjson
+
+_SSE_PREFIX = b"data: "
+_SSE_SUFFIX = b"\n\n"
+
+# Fixed framing around a content delta: data: {"content":<string>}\n\n
+_SSE_CONTENT_PREFIX = b'data: {"content":'
+_SSE_CONTENT_SUFFIX = b'}\n\n'
+
+
+def sse_event(data: dict) -> bytes:
+    """
+    Encode a payload as a single SSE ``data:`` frame.
+    
+    Args:
+        data: JSON-serializable payload
+        
+    Returns:
+        bytes: The frame ready to be yielded to a StreamingResponse
+    """
+    return _SSE_PREFIX + orjson.dumps(data) + _SSE_SUFFIX
+
+
+def sse_content(content: str) -> bytes:
+    """
+    Encode a content delta as an SSE frame.
+    
+    Args:
+        content: Text delta to send to the client
+        
+    Returns:
+        bytes: The frame ready to be yielded to a StreamingResponse
+    """
+    return _SSE_CONTENT_PREFIX + orjson.dumps(content) + _SSE_CONTENT_SUFFIX
+
+
+def sse_content_raw(escaped: bytes) -> bytes:
+    """
+    Encode an already JSON-escaped content string as a ``data:`` frame.
+    
+    Lets a string lifted verbatim from upstream JSON be forwarded without
+    decoding and re-encoding it.
+    
+    Args:
+        escaped: Body of a valid JSON string literal, without the quotes
+        
+    Returns:
+        bytes: Same frame sse_content() would produce for the decoded text
+    """
+    return _SSE_CONTENT_PREFIX + b'"' + escaped + b'"' + _SSE_CONTENT_SUFFIX
+
+
+async def coalesce_frames(
+    stream: AsyncIterator[Tuple[bytes, str]],
+    window: float
+) -> AsyncGenerator[Tuple[bytes, str], None]:
+    """
+    Merge (frame, delta) pairs that arrive within a short window.
+    
+    Upstream models often emit one token per chunk; batching them cuts the
+    number of ASGI sends without a visible delay. Frames with no content
+    delta (errors, control messages) flush the batch immediately.
+    
+    Args:
+        stream: Source of (frame, delta) pairs
+        window: Seconds to hold the first frame of a batch; 0 disables batching
+        
+    Yields:
+        tuple: (frames, deltas) concatenated across the batch
+    """
+    if window <= 0:
+        async for item in stream:
+            yield item
+        return
+    
+    loop = asyncio.get_running_loop()
+    source = stream.__aiter__()
+    frames: List[bytes] = []
+    deltas: List[str] = []
+    deadline = None
+    pending = None
+    
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(source.__anext__())
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            
+            if done:
+                task, pending = pending, None
+                try:
+                    frame, delta = task.result()
+                except StopAsyncIteration:
+                    break
+                frames.append(frame)
+                if not isinstance(delta, str):
+                    # Anything but text is a control frame: never join it
+                    delta = ""
+                deltas.append(delta)
+                if delta and deadline is None:
+                    deadline = loop.time() + window
+                if delta and loop.time() < deadline:
+                    continue
+            
+            # Window elapsed or a control frame arrived: flush the batch
+            yield b"".join(frames), "".join(deltas)
+            frames.clear()
+            deltas.clear()
+            deadline = None
+        
+        if frames:
+            yield b"".join(frames), "".join(deltas)
+    finally:
+        if pending is not None:
+            pending.cancel()
+            with contextlib.suppress(BaseException):
+                await pending
+        if hasattr(source, "aclose"):
+            await source.aclose()
+
+
+async def iter_sse_data(byte_stream: AsyncIterator[bytes]) -> AsyncGenerator[bytes, None]:
+    """
+    Extract ``data:`` payloads from a raw SSE byte stream without decoding it.
+    
+    Used to read upstream SSE responses: lines are found with bytes.find
+    on a single buffer and only ``data:`` lines are yielded, with the field
+    name stripped, so no str is built per line. Blank lines, comments and
+    other SSE fields are skipped.
+    
+    Args:
+        byte_stream: Raw response body chunks
+        
+    Yields:
+        bytes: The payload of each ``data:`` line
+    """
+    buffer = bytearray()
+    async for chunk in byte_stream:
+        buffer += chunk
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+            if buffer.startswith(b"data:", start):
+                payload_start = start + 5
+                if buffer[payload_start:payload_start + 1] == b" ":
+                    payload_start += 1
+                payload_end = end - 1 if end > payload_start and buffer[end - 1] == 13 else end
+                yield bytes(buffer[payload_start:payload_end])
+            start = end + 1
+        if start:
+            del buffer[:start]
+    if buffer.startswith(b"data:"):
+        payload = bytes(buffer[5:]).rstrip(b"\r")
+        yield payload[1:] if payload.startswith(b" ") else payload
@@ -1,90 +1,176 @@
-"""State management for tracking active sessions and generations."""
+"""
+State management for tracking active sessions and generations.
+
+All state here is event-loop-local: it is only read and mutated from
+coroutines on the server's single event loop, and no update awaits
+part-way through, so it needs no locks. Do not touch it from worker
+threads or share it across event loops.
+"""
 
 import asyncio
-from datetime import datetime, timedelta
-from typing import Dict
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Optional
 
 from app.config import Settings
 
-# Active streaming generations counter
-_active_generations = 0
-_generations_lock = asyncio.Lock()
 
-# RLM-specific generation tracking
-_active_rlm_generations = 0
-_rlm_lock = asyncio.Lock()
+@dataclass
+class _Counters:
+    """Mutable generation counters shared by all requests."""
+    generations: int = 0
+    rlm_generations: int = 0
 
-# Page load tracking for session counting (session_id: timestamp)
-_page_loads: Dict[str, datetime] = {}
-_page_loads_lock = asyncio.Lock()
 
+# Active streaming and RLM generation counters; readers may use the
+# attributes directly instead of going through the getters below
+counters = _Counters()
 
-class StateManager:
-    """Manages application state including sessions and active generations."""
+# Page load tracking for session counting (session_id: monotonic ns timestamp),
+# kept in last-seen order so expired sessions are always at the front
+_page_loads: "OrderedDict[str, int]" = OrderedDict()
+
+# Background task that expires idle sessions between stats requests
+_reaper_task: Optional[asyncio.Task] = None
+
+
+def _evict_expired_sessions() -> int:
+    """
+    Remove expired sessions from the oldest end, stopping at the first live one.
     
-    @staticmethod
-    async def increment_generations():
-        """Increment active generations counter."""
-        global _active_generations
-        async with _generations_lock:
-            _active_generations += 1
+    Returns:
+        int: Number of sessions still active
+    """
+    cutoff = time.monotonic_ns() - Settings.SESSION_TIMEOUT_MINUTES * 60_000_000_000
+    while _page_loads:
+        ts = next(iter(_page_loads.values()))
+        if ts >= cutoff:
+            break
+        _page_loads.popitem(last=False)
+    return len(_page_loads)
+
+
+async def _session_reaper():
+    """Periodically expire sessions so the table stays bounded when idle."""
+    interval = Settings.SESSION_TIMEOUT_MINUTES * 60 / 4
+    while True:
+        await asyncio.sleep(interval)
+        _evict_expired_sessions()
+
+
+@asynccontextmanager
+async def generation_slot() -> AsyncIterator[None]:
+    """
+    Count a streaming generation as active for the duration of the block.
     
-    @staticmethod
-    async def decrement_generations():
-        """Decrement active generations counter."""
-        global _active_generations
-        async with _generations_lock:
-            _active_generations -= 1
+    The counter is only touched between awaits, so it needs no lock.
+    """
+    counters.generations += 1
+    try:
+        yield
+    finally:
+        counters.generations -= 1
+
+
+def get_active_generations() -> int:
+    """Get current active generations count (same as counters.generations)."""
+    return counters.generations
+
+
+@asynccontextmanager
+async def rlm_slot() -> AsyncIterator[bool]:
+    """
+    Try to claim one of the MAX_CONCURRENT_RLM slots for the block.
     
-    @staticmethod
-    async def get_active_generations() -> int:
-        """Get current active generations count."""
-        return _active_generations
+    The capacity check and the increment run with no await between
+    them, so admission is a single atomic step on the event loop and
+    two requests can never both take the last slot.
     
-    @staticmethod
-    async def increment_rlm_generations():
-        """Increment active RLM generations counter."""
-        global _active_rlm_generations
-        async with _rlm_lock:
-            _active_rlm_generations += 1
+    Yields:
+        bool: True if a slot was claimed, False if RLM is at capacity
+    """
+    if counters.rlm_generations >= Settings.MAX_CONCURRENT_RLM:
+        yield False
+        return
+    counters.rlm_generations += 1
+    try:
+        yield True
+    finally:
+        counters.rlm_generations -= 1
+
+
+def hold_rlm_slot_until(future: asyncio.Future):
+    """
+    Keep one extra RLM slot claimed until a worker future completes.
     
-    @staticmethod
-    async def decrement_rlm_generations():
-        """Decrement active RLM generations counter."""
-        global _active_rlm_generations
-        async with _rlm_lock:
-            _active_rlm_generations -= 1
+    A request that gives up on its RLM worker (timeout or disconnect)
+    releases its own slot straight away, but the pool thread may still be
+    busy. Counting it until it returns keeps admission from ever exceeding
+    the free worker threads.
     
-    @staticmethod
-    async def get_active_rlm_generations() -> int:
-        """Get current active RLM generations count."""
-        return _active_rlm_generations
+    Args:
+        future: Event-loop future for the worker running on the RLM pool
+    """
+    counters.rlm_generations += 1
+    future.add_done_callback(_release_rlm_slot)
+
+
+def _release_rlm_slot(_future: asyncio.Future):
+    """Release a slot held by hold_rlm_slot_until (runs on the event loop)."""
+    counters.rlm_generations -= 1
+
+
+def get_active_rlm_generations() -> int:
+    """Get current active RLM generations count (same as counters.rlm_generations)."""
+    return counters.rlm_generations
+
+
+def track_session(session_id: str):
+    """
+    Track a session by its ID.
     
-    @staticmethod
-    async def check_rlm_capacity() -> bool:
-        """Check if we can accept another RLM request."""
-        async with _rlm_lock:
-            return _active_rlm_generations < Settings.MAX_CONCURRENT_RLM
+    Synchronous and lock-free: the update has no await, so it cannot
+    interleave with the sweeps that run on the same event loop.
+    """
+    _page_loads[session_id] = time.monotonic_ns()
+    _page_loads.move_to_end(session_id)
+
+
+def get_active_sessions() -> int:
+    """
+    Get count of active sessions (within timeout period).
     
-    @staticmethod
-    async def track_session(session_id: str):
-        """Track a session by its ID."""
-        async with _page_loads_lock:
-            _page_loads[session_id] = datetime.now()
+    Usually only a handful of entries expired since the reaper's last
+    pass, so trimming them here keeps the count exact at little cost.
+    """
+    return _evict_expired_sessions()
+
+
+def start_session_reaper():
+    """Start the background session reaper (called on application startup)."""
+    global _reaper_task
+    if _reaper_task is None or _reaper_task.done():
+        _reaper_task = asyncio.create_task(_session_reaper())
+
+
+def stop_session_reaper():
+    """Stop the background session reaper (called on application shutdown)."""
+    global _reaper_task
+    if _reaper_task is not None:
+        _reaper_task.cancel()
+        _reaper_task = None
+
+
+class StateManager:
+    """Backward-compatible namespace for the module-level state functions."""
     
-    @staticmethod
-    async def get_active_sessions() -> int:
-        """Get count of active sessions (within timeout period)."""
-        now = datetime.now()
-        cutoff = now - timedelta(minutes=Settings.SESSION_TIMEOUT_MINUTES)
-        
-        async with _page_loads_lock:
-            # Remove expired sessions
-            expired_sessions = [
-                sid for sid, ts in _page_loads.items() 
-                if ts < cutoff
-            ]
-            for sid in expired_sessions:
-                del _page_loads[sid]
-            
-            return len(_page_loads)
+    generation_slot = generation_slot
+    get_active_generations = get_active_generations
+    rlm_slot = rlm_slot
+    get_active_rlm_generations = get_active_rlm_generations
+    track_session = track_session
+    get_active_sessions = get_active_sessions
+    start_session_reaper = start_session_reaper
+    stop_session_reaper = stop_session_reaper
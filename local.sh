@@ -136,6 +136,8 @@ run_dev_local() {
         --port $port \
         --reload \
         --reload-dir app \
+        --loop uvloop \
+        --http httptools \
         --log-level debug
 }
 